@@ -3,12 +3,10 @@ import os
 import os.path
 import json
 import requests
+import time
 import azure.functions as func
-from langchain.agents import Tool, initialize_agent, AgentType
-from langchain_openai import AzureChatOpenAI
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import smtplib
+from llm_clients import get_forecast_agent
+from mailer import Attachment, MailDispatcher, OutgoingMail, render_forecast_html
 
 # ✅ Utility to call forecast API
 def call_forecast_api(client_name):
@@ -26,125 +24,106 @@ def call_forecast_api(client_name):
     else:
         raise Exception(f"API call failed with status {response.status_code}: {response.text}")
 
-# ✅ Utility to send email
-def send_email_with_attachment(receiver_email, subject, body_text, json_file_path, text_file_path):
-    sender_email = os.getenv("GMAIL_EMAIL")
-    sender_password = os.getenv("GMAIL_APP_PASSWORD")
-    smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-    smtp_port = int(os.getenv("SMTP_PORT", 465))
-
-    if not sender_email or not sender_password:
-        raise ValueError("GMAIL_EMAIL and/or GMAIL_APP_PASSWORD not set in environment variables")
-
-    msg = MIMEMultipart()
-    msg["From"] = sender_email
-    msg["To"] = receiver_email
-    msg["Subject"] = subject
-
-    body_text_html = body_text.replace('\n', '<br>')
-    html_body = f"""
-    <html>
-        <body>
-            <h2>📊 Margin Call Forecast Summary</h2>
-            <p>{body_text_html}</p>
-            <p>Attached are the detailed <b>JSON</b> and <b>Text</b> reports.</p>
-            <p>Regards,<br>Margin Call Forecasting Agent 🤖</p>
-        </body>
-    </html>
-    """
-    msg.attach(MIMEText(html_body, "html"))
-
-    with open(json_file_path, "r") as f:
-        mime_json = MIMEText(f.read(), "json")
-        mime_json.add_header("Content-Disposition", "attachment", filename=os.path.basename(json_file_path))
-        msg.attach(mime_json)
-
-    with open(text_file_path, "r") as f:
-        mime_text = MIMEText(f.read(), "plain")
-        mime_text.add_header("Content-Disposition", "attachment", filename=os.path.basename(text_file_path))
-        msg.attach(mime_text)
-
-    logging.info("Connecting to Gmail SMTP server...")
-    with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-
-    logging.info("✅ Email sent successfully!")
-
-# ✅ Agent runner
-def run_agent_for_client(client_name):
-    llm = AzureChatOpenAI(
-        azure_deployment=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_version=os.getenv("AZURE_OPENAI_CHAT_API_VERSION"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        temperature=0,
+# ✅ Utility to build the report email, attachments are built from in-memory buffers
+def build_report_email(receiver_email, client_name, summary, forecast_data):
+    footer_html = "<p>Attached are the detailed <b>JSON</b> and <b>Text</b> reports.</p>"
+    return OutgoingMail(
+        receiver_email=receiver_email,
+        subject=f"📧 Margin Call Forecast Report for {client_name}",
+        html_body=render_forecast_html(summary, footer_html, signature="Margin Call Forecasting Agent 🤖"),
+        attachments=[
+            Attachment(f"{client_name}_forecast.json", json.dumps(forecast_data, indent=4), "json"),
+            Attachment(f"{client_name}_forecast.txt", summary, "plain"),
+        ],
     )
 
-    forecast_tool = Tool(
-        name="Forecast Tool",
-        func=lambda client_name: call_forecast_api(client_name),
-        description="Calls the forecast API to get 3-day margin call forecast for a client."
-    )
+# ✅ Utility to send all report emails of a run as one batch
+# The dispatcher requires GMAIL_EMAIL and only logs in when a password is set (no-auth local stand-ins)
+def send_report_emails(mails):
+    logging.info(f"Connecting to SMTP server to send {len(mails)} email(s)...")
+    results = MailDispatcher.from_env().send(mails)
+    failed = [mail.receiver_email for mail, error in results if error is not None]
+    if failed:
+        raise Exception(f"Failed to send email to: {', '.join(failed)}")
 
-    tools = [forecast_tool]
+    logging.info("✅ Emails sent successfully!")
 
-    agent = initialize_agent(
-        tools=tools,
-        llm=llm,
-        agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-        verbose=True
-    )
+# ✅ Agent runner
+FORECAST_TOOL_DESCRIPTION = "Calls the forecast API to get 3-day margin call forecast for a client."
 
+def get_agent():
+    return get_forecast_agent(call_forecast_api, FORECAST_TOOL_DESCRIPTION)
+
+def run_agent_for_client(client_name):
     task_prompt = (
         f"I need to use the Forecast Tool to get the 3-day margin call forecast for '{client_name}'."
     )
 
-    return agent.run(task_prompt)
+    return get_agent().run(task_prompt)
+
+# ✅ Cold/warm start tracking, module state survives across warm invocations
+_module_loaded_at = time.perf_counter()
+_invocation_count = 0
+
+def log_start_timing():
+    global _invocation_count
+    _invocation_count += 1
+    start_kind = "Cold" if _invocation_count == 1 else "Warm"
+    logging.info(
+        f"⏱️ {start_kind} start: invocation #{_invocation_count}, "
+        f"{time.perf_counter() - _module_loaded_at:.2f}s since module load"
+    )
+
+def warm_up():
+    started = time.perf_counter()
+    get_agent()
+    elapsed = time.perf_counter() - started
+    logging.info(f"⏱️ Agent and LLM client ready in {elapsed:.3f}s")
+    return elapsed
 
 # ✅ Main Function - No POST body required anymore
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('🔔 Azure Function HTTP Triggered')
+    log_start_timing()
 
     try:
-        # Basic Health Check (Optional)
+        # Health Check / Warm-up: pre-initializes the agent and LLM client
         if req.method == "GET":
-            return func.HttpResponse("✅ Margin Forecast Function is running!", status_code=200)
+            elapsed = warm_up()
+            return func.HttpResponse(
+                f"✅ Margin Forecast Function is running! Agent ready in {elapsed:.3f}s",
+                status_code=200
+            )
 
-        # Read client name and receiver email from environment
-        client_name = os.getenv("CLIENT_NAME")
-        receiver_email = os.getenv("RECEIVER_EMAIL")
+        # Read client name(s) and receiver email(s) from environment, comma-separated for portfolio runs
+        client_names = [c.strip() for c in os.getenv("CLIENT_NAME", "").split(",") if c.strip()]
+        receiver_emails = [e.strip() for e in os.getenv("RECEIVER_EMAIL", "").split(",") if e.strip()]
 
-        if not client_name or not receiver_email:
+        if not client_names or not receiver_emails:
             return func.HttpResponse("CLIENT_NAME or RECEIVER_EMAIL not set in environment variables.", status_code=500)
 
-        logging.info(f"Running forecast for Client: {client_name}, sending report to: {receiver_email}")
-
-        reports_dir = "/tmp/reports"
-        os.makedirs(reports_dir, exist_ok=True)
-
-        # Run Agent
-        summary = run_agent_for_client(client_name)
-
-        # Save Reports
-        json_data_path = os.path.join(reports_dir, f"{client_name}_forecast.json")
-        text_file_path = os.path.join(reports_dir, f"{client_name}_forecast.txt")
-
-        forecast_data = call_forecast_api(client_name)
+        logging.info(f"Running forecast for Clients: {client_names}, sending reports to: {receiver_emails}")
 
-        with open(json_data_path, "w") as f:
-            json.dump(forecast_data, f, indent=4)
+        mails = []
+        for client_name in client_names:
+            # Run Agent
+            summary = run_agent_for_client(client_name)
+            forecast_data = call_forecast_api(client_name)
 
-        with open(text_file_path, "w") as f:
-            f.write(summary)
+            mails.extend(
+                build_report_email(receiver_email, client_name, summary, forecast_data)
+                for receiver_email in receiver_emails
+            )
 
-        logging.info("✅ Files created successfully.")
+        logging.info("✅ Reports built successfully.")
 
-        subject = f"📧 Margin Call Forecast Report for {client_name}"
-        send_email_with_attachment(receiver_email, subject, summary, json_data_path, text_file_path)
+        send_report_emails(mails)
 
-        logging.info(f"✅ Email sent to {receiver_email}.")
-        return func.HttpResponse(f"✅ Forecast Report for {client_name} sent to {receiver_email}", status_code=200)
+        logging.info(f"✅ Emails sent to {receiver_emails}.")
+        return func.HttpResponse(
+            f"✅ Forecast Report for {', '.join(client_names)} sent to {', '.join(receiver_emails)}",
+            status_code=200
+        )
 
     except Exception as e:
         logging.error(f"❌ Error occurred: {str(e)}", exc_info=True)
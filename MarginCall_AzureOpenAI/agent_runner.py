@@ -2,12 +2,8 @@ import os
 import json
 import requests
 from dotenv import load_dotenv
-from langchain.agents import Tool, initialize_agent, AgentType
-from langchain_openai import AzureChatOpenAI
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email import encoders
-import smtplib
+from llm_clients import get_forecast_agent
+from mailer import MailDispatcher, OutgoingMail, render_forecast_html
 
 load_dotenv()
 
@@ -24,63 +20,36 @@ def call_forecast_api(client_name):
         raise Exception(f"API call failed with status {response.status_code}: {response.text}")
 
 # ---- Email Utility ----
-def send_email_with_attachment(subject, body_text):
-    sender_email = os.getenv("GMAIL_EMAIL")
-    receiver_email = os.getenv("TO_EMAIL")
-    sender_password = os.getenv("GMAIL_APP_PASSWORD")
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = int(os.getenv("SMTP_PORT"))
-
-    msg = MIMEMultipart()
-    msg["From"] = sender_email
-    msg["To"] = receiver_email
-    msg["Subject"] = subject
-
-    # Email body
-    body_text_html = body_text.replace('\n', '<br>')
-
-    html_body = f"""
-    <html>
-        <body>
-            <h2>📊 Margin Call Forecast Summary</h2>
-            <p>{body_text_html}</p>
-            <p>Regards,<br>Margin Call Agent</p>
-        </body>
-    </html>
-    """
-    msg.attach(MIMEText(html_body, "html"))
-
-    # ✅ Use SMTP_SSL
-    with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-
-    print("✅ Email sent successfully via Gmail!")
-
-# ---- Agent Task ----
-def run_agent_for_client(client_name):
-    llm = AzureChatOpenAI(
-        azure_deployment=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_version=os.getenv("AZURE_OPENAI_CHAT_API_VERSION"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        temperature=0,
+def build_forecast_email(receiver_email, subject, body_text):
+    return OutgoingMail(
+        receiver_email=receiver_email,
+        subject=subject,
+        html_body=render_forecast_html(body_text),
     )
 
-    forecast_tool = Tool(
-        name="Forecast Tool",
-        func=lambda client_name: call_forecast_api(client_name),
-        description="Calls the forecast API to get 3-day margin call forecast along with the confidence score for a client."
-    )
+def get_receiver_emails():
+    receiver_emails = [e.strip() for e in os.getenv("TO_EMAIL", "").split(",") if e.strip()]
+    if not receiver_emails:
+        raise ValueError("TO_EMAIL not set in environment variables")
+    return receiver_emails
 
-    tools = [forecast_tool]
+def send_email_with_attachment(subject, body_text):
+    mails = [build_forecast_email(receiver, subject, body_text) for receiver in get_receiver_emails()]
+    return send_emails(mails)
 
-    agent = initialize_agent(
-        tools=tools,
-        llm=llm,
-        agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-        verbose=True
-    )
+def send_emails(mails):
+    results = MailDispatcher.from_env().send(mails)
+    failed = [mail.receiver_email for mail, error in results if error is not None]
+    if failed:
+        raise Exception(f"Failed to send email to: {', '.join(failed)}")
+    print(f"✅ {len(results)} email(s) sent successfully via Gmail!")
+    return results
+
+# ---- Agent Task ----
+FORECAST_TOOL_DESCRIPTION = "Calls the forecast API to get 3-day margin call forecast along with the confidence score for a client."
+
+def run_agent_for_client(client_name):
+    agent = get_forecast_agent(call_forecast_api, FORECAST_TOOL_DESCRIPTION)
 
     # Task Prompt
     task_prompt = (
@@ -91,24 +60,30 @@ def run_agent_for_client(client_name):
 
 # ---- Main ----
 if __name__ == "__main__":
-    client = input("Enter Client Name: ")
+    # Accepts a single client or a comma-separated list for portfolio-wide runs
+    clients = [c.strip() for c in input("Enter Client Name(s): ").split(",") if c.strip()]
+    # Fail before running the agent rather than reporting "0 emails sent" at the end
+    receiver_emails = get_receiver_emails()
 
     # Create reports directory if it doesn't exist
     reports_dir = "reports"
     os.makedirs(reports_dir, exist_ok=True)
 
-    # Run agent
-    summary = run_agent_for_client(client)
+    mails = []
+    for client in clients:
+        # Run agent
+        summary = run_agent_for_client(client)
 
-    # Save Text Report
-    text_file_path = os.path.join(reports_dir, f"{client}_forecast.txt")
-    
-    with open(text_file_path, "w") as f:
-        f.write(summary)
+        # Save Text Report
+        text_file_path = os.path.join(reports_dir, f"{client}_forecast.txt")
 
-    print("✅ Files created in reports/ folder.")
+        with open(text_file_path, "w") as f:
+            f.write(summary)
+
+        subject = f"📧 Margin Call Forecast Report for {client}"
+        mails.extend(build_forecast_email(receiver, subject, summary) for receiver in receiver_emails)
 
-    # Send Email
-    subject = f"📧 Margin Call Forecast Report for {client}"
+    print("✅ Files created in reports/ folder.")
 
-    send_email_with_attachment(subject, summary)
\ No newline at end of file
+    # Send all reports in one batch over reused connections
+    send_emails(mails)
@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import json
+import html
 from datetime import datetime
 import pandas as pd
 import plotly.graph_objects as go
@@ -9,6 +10,9 @@ import streamlit.components.v1 as components
 # FastAPI endpoint base URL
 API_BASE_URL = "http://localhost:8000"
 
+# Cached API responses expire after this many seconds
+API_CACHE_TTL_SECONDS = 300
+
 # Helper function to handle API errors
 def handle_api_response(response, error_message="Failed to fetch data"):
     if response.status_code == 200:
@@ -17,6 +21,64 @@ def handle_api_response(response, error_message="Failed to fetch data"):
         st.error(f"{error_message}: {response.status_code} - {response.text}")
         return None
 
+class APIError(Exception):
+    pass
+
+# Cached POST keyed on endpoint + canonical JSON payload, errors are raised so they are never cached
+@st.cache_data(ttl=API_CACHE_TTL_SECONDS, show_spinner=False)
+def cached_post(endpoint, payload_json):
+    headers = {"Content-Type": "application/json"}
+    response = requests.post(f"{API_BASE_URL}{endpoint}", data=payload_json, headers=headers)
+    if response.status_code != 200:
+        raise APIError(f"{response.status_code} - {response.text}")
+    return response.json()["response"]
+
+def fetch_api(endpoint, payload, error_message="Failed to fetch data"):
+    try:
+        return cached_post(endpoint, json.dumps(payload, sort_keys=True))
+    except (APIError, requests.RequestException) as e:
+        st.error(f"{error_message}: {e}")
+        return None
+
+# The API returns typed values, formatting for display happens only here
+def format_currency(amount):
+    return f"${amount:,.2f}"
+
+def format_percent(value):
+    return f"{value:.2f}%"
+
+def format_yes_no(flag):
+    return "Yes" if flag else "No"
+
+# Chat history limits: bounded in memory, paginated on screen
+MAX_CHAT_HISTORY = 200
+CHAT_PAGE_SIZE = 20
+CHAT_CONTEXT_TURNS = 6
+
+def render_chat_message(role, message):
+    role_class = "user-wrapper" if role == "User" else "bot-wrapper"
+    message_class = "user-message" if role == "User" else "bot-message"
+    icon = "👤" if role == "User" else "🤖"
+    message_html = html.escape(str(message)).replace("\n", "<br/>")
+
+    return f'''
+        <div class="message-wrapper {role_class}">
+            <div class="message-card {message_class}">
+                <strong>{icon} {role}</strong><br/>
+                {message_html}
+            </div>
+        </div>
+        '''
+
+def add_chat_message(role, message, failed=False):
+    # Failed turns stay on screen but are never sent back to the API as history
+    st.session_state.messages.append(
+        {"role": role, "message": message, "html": render_chat_message(role, message), "failed": failed}
+    )
+    # Drop the oldest messages once the history is full
+    if len(st.session_state.messages) > MAX_CHAT_HISTORY:
+        st.session_state.messages = st.session_state.messages[-MAX_CHAT_HISTORY:]
+
 # Streamlit setup
 st.set_page_config(
     layout="wide",
@@ -47,18 +109,20 @@ with st.sidebar:
 if view_option == "📈 Forecast":
     st.subheader(f"📋 Forecast for {selected_client} (T+1 to T+3)")
 
-    headers = {"Content-Type": "application/json"}
     data = {"Client": selected_client}
 
+    if st.button("🔄 Refresh Forecast"):
+        cached_post.clear()
+
     with st.spinner("🔄 Thinking... Generating Forecast..."):
-        response = requests.post(f"{API_BASE_URL}/forecast", json=data, headers=headers)
-        result = handle_api_response(response, "Failed to fetch forecast")
+        result = fetch_api("/forecast", data, "Failed to fetch forecast")
 
     if result:
         try:
             df = pd.DataFrame(result)
             df = df[["Date", "MarginCallRequired", "MarginCallAmount", "ConfidenceScore", "Comments"]]
 
+            df["MarginCallRequired"] = df["MarginCallRequired"].map(format_yes_no)
             df = df.rename(columns={
                 "Date": "Margin Call Date",
                 "MarginCallRequired": "Margin Call Required?",
@@ -120,7 +184,11 @@ if view_option == "📈 Forecast":
             )
 
             # Render the table
-            st.markdown(df.to_html(index=False, escape=False), unsafe_allow_html=True)
+            display_df = df.assign(**{
+                "Margin Call Amount (USD)": df["Margin Call Amount (USD)"].map(format_currency),
+                "Confidence Score (%)": df["Confidence Score (%)"].map(format_percent),
+            })
+            st.markdown(display_df.to_html(index=False, escape=False), unsafe_allow_html=True)
 
             # Combined Line Chart
             fig = go.Figure()
@@ -136,7 +204,7 @@ if view_option == "📈 Forecast":
 
             fig.add_trace(go.Scatter(
                 x=pd.to_datetime(df["Margin Call Date"]).dt.strftime('%Y-%m-%d'),
-                y=df["Confidence Score (%)"].str.rstrip('%').astype(float),
+                y=df["Confidence Score (%)"],
                 mode="lines+markers",
                 name="Confidence Score (%)",
                 line=dict(color='seagreen', width=3, dash='dot'),
@@ -168,45 +236,63 @@ elif view_option == "🔧 What-If Scenario":
 
     with left_col:
         st.subheader("🔧 Adjust Parameters")
-        mtm = st.slider("MTM (USD)", min_value=0, max_value=3_0_000_00, value=400000, step=10_000)
-        collateral = st.slider("Collateral (USD)", min_value=0, max_value=5_000_00, value=100000, step=10_000)
-        threshold = st.slider("Threshold (USD)", min_value=0, max_value=4_00_000, value=30000, step=10_000)        
-        volatility = st.slider("Market Volatility (VIX)", 0, 50, 20)
-        interest_rate = st.slider("Interest Rate (%)", 0.0, 10.0, 2.5, step=0.1)
+        # Sliders live in a form so dragging them does not fire requests until Apply is pressed
+        with st.form("what_if_form"):
+            mtm = st.slider("MTM (USD)", min_value=0, max_value=3_0_000_00, value=400000, step=10_000)
+            collateral = st.slider("Collateral (USD)", min_value=0, max_value=5_000_00, value=100000, step=10_000)
+            threshold = st.slider("Threshold (USD)", min_value=0, max_value=4_00_000, value=30000, step=10_000)
+            volatility = st.slider("Market Volatility (VIX)", 0, 50, 20)
+            interest_rate = st.slider("Interest Rate (%)", 0.0, 10.0, 2.5, step=0.1)
+            applied = st.form_submit_button("▶️ Apply Scenario")
+
+        if applied or st.session_state.get("what_if_client") != selected_client:
+            st.session_state.what_if_client = selected_client
+            st.session_state.what_if_input = {
+                "Client": selected_client,
+                "MTM": mtm,
+                "Collateral": collateral,
+                "Threshold": threshold,
+                "Volatility": volatility,
+                "InterestRate": interest_rate,
+                "MTA": 1000,
+                "Currency": "USD"
+            }
 
     with right_col:
         st.subheader(f"📋 What-If Scenario: AI-Based Analysis for {selected_client}")
-        input_data = {
-            "Client": selected_client,
-            "MTM": mtm,
-            "Collateral": collateral,
-            "Threshold": threshold,
-            "Volatility": volatility,
-            "InterestRate": interest_rate,
-            "MTA": 1000,
-            "Currency": "USD"
-        }
-
-        headers = {"Content-Type": "application/json"}
+        input_data = st.session_state.what_if_input
+
+        # Cheap ML-only prediction first, the LLM explanation fills in below once it arrives
+        prediction = fetch_api("/what-if/predict", input_data, "Failed to fetch what-if prediction")
+        details_placeholder = st.empty()
+        if prediction:
+            with details_placeholder.container():
+                with st.expander("📋 Margin Call Details", expanded=True):
+                    st.write(f"📅 **Date:** {prediction['Date']}")
+                    margin_call_icon = "✅" if prediction['MarginCallRequired'] else "❌"
+                    st.write(f"{margin_call_icon} **Margin Call Required?** {format_yes_no(prediction['MarginCallRequired'])}")
+                    st.write(f"💰 **Margin Call Amount (USD):** {format_currency(prediction['MarginCallAmount'])}")
+                    st.write(f"📈 **Confidence Score:** {format_percent(prediction['ConfidenceScore'])}")
+                    st.write("📝 **Details:** _Generating explanation..._")
 
         with st.spinner("🔄 Thinking... Performing What-If Analysis..."):
-            response = requests.post(f"{API_BASE_URL}/what-if", json=input_data, headers=headers)
-            result = handle_api_response(response, "Failed to fetch what-if analysis")
+            result = fetch_api("/what-if", input_data, "Failed to fetch what-if analysis")
 
         if result:
+            details_placeholder.empty()
             try:
-                margin_call_amount = float(str(result.get("MarginCallAmount", 0)).replace(",", "").replace("$", "").replace("%", ""))
-                confidence_score = float(str(result.get("ConfidenceScore", "0%")).rstrip('%'))
+                margin_call_amount = result["MarginCallAmount"]
+                confidence_score = result["ConfidenceScore"]
 
                 df = pd.DataFrame([result])
                 df = df[["Date", "MarginCallRequired", "MarginCallAmount", "ConfidenceScore", "Comments"]]
 
                 with st.expander("📋 Margin Call Details", expanded=True):
                     st.write(f"📅 **Date:** {result['Date']}")
-                    margin_call_icon = "✅" if result['MarginCallRequired'].lower() == "yes" else "❌"
-                    st.write(f"{margin_call_icon} **Margin Call Required?** {result['MarginCallRequired']}")
-                    st.write(f"💰 **Margin Call Amount (USD):** {result['MarginCallAmount']}")
-                    st.write(f"📈 **Confidence Score:** {result['ConfidenceScore']}")
+                    margin_call_icon = "✅" if result['MarginCallRequired'] else "❌"
+                    st.write(f"{margin_call_icon} **Margin Call Required?** {format_yes_no(result['MarginCallRequired'])}")
+                    st.write(f"💰 **Margin Call Amount (USD):** {format_currency(margin_call_amount)}")
+                    st.write(f"📈 **Confidence Score:** {format_percent(confidence_score)}")
                     st.write(f"📝 **Details:** {result['Comments']}")
 
                 # Combined Line Chart for What-If
@@ -257,7 +343,7 @@ elif view_option == "🔧 What-If Scenario":
                     y=[margin_call_amount],
                     name="Margin Call Amount (USD)",
                     marker_color="indianred",
-                    text=[f"${margin_call_amount}"],
+                    text=[format_currency(margin_call_amount)],
                     textposition="outside"
                 ))
 
@@ -267,7 +353,7 @@ elif view_option == "🔧 What-If Scenario":
                     y=[confidence_score],
                     name="Confidence Score (%)",
                     marker_color="royalblue",
-                    text=[f"{confidence_score}%"],
+                    text=[format_percent(confidence_score)],
                     textposition="outside"
                 ))
 
@@ -286,6 +372,40 @@ elif view_option == "🔧 What-If Scenario":
                 st.error(f"Error parsing what-if response: {str(e)}")
                 st.write("⚠️ Please check the LLM response format.")
 
+        # Sensitivity surface: the whole MTM x Volatility grid comes back from one request
+        st.subheader("🌡️ Sensitivity: Margin Call Probability by MTM and Volatility")
+        grid_payload = {k: v for k, v in input_data.items() if k != "Currency"}
+        grid_payload.update({"MTMRange": [0, 3_000_000], "VolatilityRange": [0, 50], "GridSize": 50})
+        grid = fetch_api("/what-if/grid", grid_payload, "Failed to fetch sensitivity grid")
+
+        if grid:
+            heatmap = go.Figure()
+            heatmap.add_trace(go.Heatmap(
+                x=grid["MTM"],
+                y=grid["Volatility"],
+                z=[[p * 100 for p in row] for row in grid["Probability"]],
+                colorscale="RdYlGn_r",
+                zmin=0,
+                zmax=100,
+                colorbar=dict(title="Probability (%)"),
+                hovertemplate="MTM: %{x:,.0f}<br>Volatility: %{y:.1f}<br>Probability: %{z:.1f}%<extra></extra>"
+            ))
+            # Mark the currently applied scenario
+            heatmap.add_trace(go.Scatter(
+                x=[input_data["MTM"]],
+                y=[input_data["Volatility"]],
+                mode="markers",
+                name="Current Scenario",
+                marker=dict(size=14, color="black", symbol="x")
+            ))
+            heatmap.update_layout(
+                xaxis=dict(title="MTM (USD)"),
+                yaxis=dict(title="Market Volatility (VIX)"),
+                template="plotly_white",
+                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+            )
+            st.plotly_chart(heatmap, use_container_width=True)
+
 # ---------- Ask Anything View ----------
 elif view_option == "❓ Ask Anything":
     # ---------- Ask Anything View ----------
@@ -294,21 +414,40 @@ elif view_option == "❓ Ask Anything":
     # Initialize session state for chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "chat_pages_shown" not in st.session_state:
+        st.session_state.chat_pages_shown = 1
 
     # Reset Chat History button
     if st.button("🗑️ Reset Chat History"):
         st.session_state.messages = []
+        st.session_state.chat_pages_shown = 1
 
     # Function to handle submission
     def submit_query():
         query = st.session_state.query_input
         if query:
-            st.session_state.messages.append({"role": "User", "message": query})
+            # Compact context for follow-ups, the API summarizes it further
+            answered = [m for m in st.session_state.messages if not m.get("failed")]
+            history = [
+                {"role": m["role"], "message": str(m["message"])}
+                for m in answered[-CHAT_CONTEXT_TURNS:]
+            ]
+            add_chat_message("User", query)
 
             with st.spinner("🔄 Thinking... Fetching response..."):
-                response = requests.post(f"{API_BASE_URL}/ask", json={"query": query})
-                result = handle_api_response(response, "Failed to fetch response")
-                st.session_state.messages.append({"role": "Bot", "message": result})
+                try:
+                    response = requests.post(f"{API_BASE_URL}/ask", json={"query": query, "history": history})
+                    result = handle_api_response(response, "Failed to fetch response")
+                except requests.RequestException as e:
+                    st.error(f"Failed to fetch response: {e}")
+                    result = None
+
+                if result is None:
+                    # Drop the unanswered question from future context as well
+                    st.session_state.messages[-1]["failed"] = True
+                    add_chat_message("Bot", "⚠️ No answer, please try again.", failed=True)
+                else:
+                    add_chat_message("Bot", result)
 
             # Clear the input
             st.session_state.query_input = ""
@@ -316,6 +455,15 @@ elif view_option == "❓ Ask Anything":
     # Text input with `on_change`
     st.text_input("Enter your question:", placeholder="e.g., What factors influence margin calls?", key="query_input", on_change=submit_query)
 
+    # Only the newest pages are rendered, older ones load on demand
+    total_messages = len(st.session_state.messages)
+    visible_count = st.session_state.chat_pages_shown * CHAT_PAGE_SIZE
+    if total_messages > visible_count:
+        if st.button(f"⬆️ Load older messages ({total_messages - visible_count} hidden)"):
+            st.session_state.chat_pages_shown += 1
+            visible_count += CHAT_PAGE_SIZE
+    visible_messages = st.session_state.messages[-visible_count:]
+
     # Styling for fixed chat container
     chat_html = """
         <style>
@@ -362,20 +510,8 @@ elif view_option == "❓ Ask Anything":
         <div class="chat-container" id="chat-container">
     """
 
-    # Add messages dynamically
-    for msg in st.session_state.messages:
-        role_class = "user-wrapper" if msg["role"] == "User" else "bot-wrapper"
-        message_class = "user-message" if msg["role"] == "User" else "bot-message"
-        icon = "👤" if msg["role"] == "User" else "🤖"
-        
-        chat_html += f'''
-        <div class="message-wrapper {role_class}">
-            <div class="message-card {message_class}">
-                <strong>{icon} {msg["role"]}</strong><br/>
-                {msg["message"]}
-            </div>
-        </div>
-        '''
+    # Add messages, each one was rendered to HTML once when it was added
+    chat_html += "".join(msg["html"] for msg in visible_messages)
 
     # Close chat container
     chat_html += """
@@ -0,0 +1,55 @@
+# benchmarks/bench_client_encoding.py
+#
+# Per-row client encoding cost: LabelEncoder.transform (old prediction path)
+# vs the precomputed ClientCodeLookup used by the model bundle.
+#   python benchmarks/bench_client_encoding.py --clients 6 --rows 1 1000
+
+import os
+import sys
+import json
+import timeit
+import argparse
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_store import ClientCodeLookup
+
+
+def bench(fn, repeat=5):
+    # Best-of-N seconds per call
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(n_clients, row_counts):
+    clients = [f"Client{i}" for i in range(n_clients)]
+    encoder = LabelEncoder().fit(clients)
+    lookup = ClientCodeLookup(encoder)
+    rng = np.random.default_rng(0)
+
+    results = []
+    for n_rows in row_counts:
+        batch = list(rng.choice(clients, size=n_rows))
+        label_encoder_s = bench(lambda: encoder.transform(batch))
+        lookup_s = bench(lambda: lookup.encode(batch))
+        results.append({
+            "benchmark": "client_encoding",
+            "clients": n_clients,
+            "rows": n_rows,
+            "label_encoder_us_per_row": round(label_encoder_s / n_rows * 1e6, 3),
+            "lookup_us_per_row": round(lookup_s / n_rows * 1e6, 3),
+            "speedup": round(label_encoder_s / lookup_s, 1),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Client encoding micro-benchmark")
+    parser.add_argument("--clients", type=int, default=6)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100, 10_000])
+    args = parser.parse_args()
+
+    for result in run(args.clients, args.rows):
+        print(json.dumps(result))
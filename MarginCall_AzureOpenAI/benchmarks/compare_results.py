@@ -0,0 +1,41 @@
+# benchmarks/compare_results.py
+#
+# Compare two run_benchmarks.py result files:
+#   python benchmarks/compare_results.py results/abc123-....json results/def456-....json
+
+import json
+import argparse
+
+
+def result_key(result):
+    return tuple((k, result[k]) for k in ("benchmark", "endpoint", "mode", "rows", "k", "concurrency", "clients") if k in result)
+
+
+def load_results(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report["meta"], {result_key(r): r for r in report["results"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="p50_ms")
+    args = parser.parse_args()
+
+    base_meta, base = load_results(args.baseline)
+    cand_meta, cand = load_results(args.candidate)
+    print(f"{args.metric}: {base_meta['commit']} -> {cand_meta['commit']}")
+
+    for key in base:
+        if key not in cand or args.metric not in base[key] or args.metric not in cand[key]:
+            continue
+        before, after = base[key][args.metric], cand[key][args.metric]
+        change = (after - before) / before * 100 if before else 0.0
+        label = " ".join(f"{k}={v}" for k, v in key)
+        print(f"  {label:<70} {before:>12.3f} {after:>12.3f} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/fake_azure_openai.py
+#
+# Local stand-in for the Azure OpenAI chat completions and embeddings endpoints,
+# with configurable latency, so benchmarks never depend on the real service.
+#   python benchmarks/fake_azure_openai.py --port 8765 --chat-latency-ms 800
+
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+EMBEDDING_DIM = 256
+FAKE_COMPLETION = "Simulated explanation: exposure above collateral and threshold drives the margin call."
+
+
+def fake_embedding(text):
+    # Deterministic per text, so FAISS queries and repeated runs are reproducible
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    vector = rng.standard_normal(EMBEDDING_DIM)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def make_handler(chat_latency_s, embedding_latency_s, counters):
+    class FakeAzureOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?")[0]
+
+            if re.search(r"/openai/deployments/[^/]+/chat/completions$", path):
+                counters["chat"] += 1
+                time.sleep(chat_latency_s)
+                prompt_chars = sum(len(str(m.get("content", ""))) for m in request.get("messages", []))
+                prompt_tokens = max(1, prompt_chars // 4)
+                completion_tokens = len(FAKE_COMPLETION) // 4
+                counters["prompt_tokens"] += prompt_tokens
+                self._send_json({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake-gpt"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": FAKE_COMPLETION},
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+            elif re.search(r"/openai/deployments/[^/]+/embeddings$", path):
+                counters["embeddings"] += 1
+                time.sleep(embedding_latency_s)
+                inputs = request.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                # langchain may send token ids instead of strings
+                texts = [t if isinstance(t, str) else " ".join(map(str, t)) for t in inputs]
+                self._send_json({
+                    "object": "list",
+                    "model": request.get("model", "fake-embedding"),
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                        for i, text in enumerate(texts)
+                    ],
+                    "usage": {"prompt_tokens": len(texts), "total_tokens": len(texts)},
+                })
+            else:
+                self._send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+    return FakeAzureOpenAIHandler
+
+
+def start_fake_server(host="127.0.0.1", port=0, chat_latency_ms=0, embedding_latency_ms=0):
+    # Returns (server, base_url); server.counters counts calls per endpoint
+    counters = {"chat": 0, "embeddings": 0, "prompt_tokens": 0}
+    handler = make_handler(chat_latency_ms / 1000, embedding_latency_ms / 1000, counters)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.counters = counters
+    threading.Thread(target=server.serve_forever, name="fake-azure-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI chat/embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency-ms", type=float, default=0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    server, url = start_fake_server(args.host, args.port, args.chat_latency_ms, args.embedding_latency_ms)
+    print(f"🧪 Fake Azure OpenAI listening on {url} (set AZURE_OPENAI_ENDPOINT={url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
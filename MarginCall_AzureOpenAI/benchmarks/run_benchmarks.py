@@ -0,0 +1,307 @@
+# benchmarks/run_benchmarks.py
+#
+# Model inference micro-benchmarks, FAISS load/query timing and end-to-end API
+# load tests against a fake Azure OpenAI server. Results go to one JSON file so
+# runs can be compared across commits (see compare_results.py).
+#   cd MarginCall_AzureOpenAI && python benchmarks/run_benchmarks.py --chat-latency-ms 500
+# Embeddings are sent as raw text (no tiktoken encoding download), so the suite runs offline.
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_azure_openai import start_fake_server
+from retrieval import RETRIEVAL_MODES
+
+SAMPLE_ROW = {
+    "Client": "ClientA",
+    "MTM": 8453464.0,
+    "Collateral": 7388691.0,
+    "Threshold": 1010719.0,
+    "Volatility": 29.0,
+    "InterestRate": 5.1,
+    "MTA": 100000.0,
+}
+
+
+# ---- Timing Helpers ----
+def latency_summary(samples_s):
+    samples_ms = np.asarray(samples_s) * 1000
+    return {
+        "n": int(len(samples_ms)),
+        "mean_ms": round(float(samples_ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 4),
+        "min_ms": round(float(samples_ms.min()), 4),
+    }
+
+
+def time_calls(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ---- Environment ----
+def point_at_fake_server(base_url, index_dir):
+    # Must run before forecaster is imported: clients read these on first use
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": base_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_CHAT_DEPLOYMENT": "fake-chat",
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "fake-embedding",
+        "AZURE_OPENAI_CHAT_API_VERSION": "2024-02-01",
+        "AZURE_OPENAI_EMBEDDING_API_VERSION": "2024-02-01",
+        "AZURE_OPENAI_EMBEDDING_CHECK_CTX_LENGTH": "false",
+        "FAISS_INDEX_DIR": index_dir,
+        "FORECAST_STORE_PATH": os.path.join(index_dir, "forecast_store.sqlite"),
+    })
+
+
+# ---- Model Inference ----
+def bench_models(forecaster, iterations, batch_sizes):
+    results = []
+    bundle = forecaster.current_bundle()
+
+    single = {
+        "predict_with_lightgbm": lambda: forecaster.predict_with_lightgbm(SAMPLE_ROW),
+        "predict_with_lstm": lambda: forecaster.predict_with_lstm(SAMPLE_ROW),
+        "hybrid_predict_margin_call": lambda: forecaster.hybrid_predict_margin_call(SAMPLE_ROW),
+    }
+    for name, fn in single.items():
+        results.append({"benchmark": name, "rows": 1, **latency_summary(time_calls(fn, iterations))})
+
+    for batch_size in batch_sizes:
+        rows = [{**SAMPLE_ROW, "MTM": SAMPLE_ROW["MTM"] * (0.5 + i / batch_size)} for i in range(batch_size)]
+        feature_matrix = forecaster.build_feature_matrix(rows, bundle)
+        batched = {
+            "predict_with_lightgbm": lambda: forecaster.predict_with_lightgbm(rows),
+            "predict_with_lstm": lambda: forecaster.predict_with_lstm(rows),
+            "predict_with_ensemble": lambda: forecaster.predict_with_ensemble(feature_matrix, bundle),
+            "predict_margin_calls": lambda: forecaster.predict_margin_calls(rows, bundle),
+        }
+        batch_iterations = max(5, iterations // max(1, batch_size // 100))
+        for name, fn in batched.items():
+            summary = latency_summary(time_calls(fn, batch_iterations))
+            summary["rows_per_sec"] = round(batch_size / (summary["mean_ms"] / 1000), 1)
+            results.append({"benchmark": f"{name}_batch", "rows": batch_size, **summary})
+    return results
+
+
+# ---- FAISS ----
+def bench_faiss(forecaster, iterations, k_values):
+    results = [{
+        "benchmark": "faiss_load",
+        **latency_summary(time_calls(forecaster.load_local_vectorstore, max(5, iterations // 10), warmup=1)),
+    }]
+    vector_store = forecaster.load_local_vectorstore()
+    query = "Which clients had margin calls when volatility was above 30?"
+    for k in k_values:
+        samples = time_calls(lambda: vector_store.similarity_search(query, k=k), iterations)
+        results.append({"benchmark": "faiss_query", "k": k, **latency_summary(samples)})
+        # Retriever path per mode; repeated queries hit the query-embedding cache
+        for mode in RETRIEVAL_MODES:
+            retriever = forecaster.get_retriever(k, mode=mode)
+            samples = time_calls(lambda: retriever.invoke(query), iterations)
+            results.append({"benchmark": "retrieval_query", "mode": mode, "k": k, **latency_summary(samples)})
+    return results
+
+
+# ---- End-to-End API Load ----
+def start_api_server(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="benchmark-api", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def load_test(url, payload, concurrency, requests_total):
+    import requests
+    session_local = threading.local()
+
+    def one_request(_):
+        session = getattr(session_local, "session", None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = session.post(url, json=payload, timeout=300).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(requests_total)))
+    wall_s = time.perf_counter() - started
+
+    latencies = [latency for latency, ok in outcomes if ok]
+    summary = latency_summary(latencies) if latencies else {"n": 0}
+    summary.update({
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "throughput_rps": round(len(latencies) / wall_s, 2),
+        "wall_s": round(wall_s, 3),
+    })
+    return summary
+
+
+@contextmanager
+def forecast_store_misses(forecaster):
+    # Every /forecast lookup misses the forecast store, so each request runs the retrievals and
+    # LLM calls again (concurrent identical requests still share one computation)
+    load_forecast = forecaster.load_forecast
+    forecaster.load_forecast = lambda *args, **kwargs: None
+    try:
+        yield
+    finally:
+        forecaster.load_forecast = load_forecast
+
+
+def bench_api(app, forecaster, fake_server, concurrency_levels, requests_per_level):
+    port = free_port()
+    api = start_api_server(app, port)
+    base = f"http://127.0.0.1:{port}"
+    forecast_payload = {"Client": SAMPLE_ROW["Client"]}
+    # (endpoint, mode, payload, context the level runs in): /forecast is measured computing
+    # every forecast (cold) and served from the forecast store (warm), which differ by orders of magnitude
+    scenarios = [
+        ("/what-if", None, SAMPLE_ROW, nullcontext),
+        ("/forecast", "cold", forecast_payload, lambda: forecast_store_misses(forecaster)),
+        ("/forecast", "warm", forecast_payload, nullcontext),
+        ("/ask", None, {"query": "What factors influence margin calls for ClientA?"}, nullcontext),
+    ]
+
+    results = []
+    try:
+        for endpoint, mode, payload, context in scenarios:
+            if mode == "warm":
+                # The store holds this forecast before timing starts
+                load_test(base + endpoint, payload, 1, 1)
+            for concurrency in concurrency_levels:
+                calls_before = dict(fake_server.counters)
+                with context():
+                    summary = load_test(base + endpoint, payload, concurrency, requests_per_level)
+                summary["llm_calls"] = fake_server.counters["chat"] - calls_before["chat"]
+                summary["embedding_calls"] = fake_server.counters["embeddings"] - calls_before["embeddings"]
+                summary["llm_prompt_tokens"] = fake_server.counters["prompt_tokens"] - calls_before["prompt_tokens"]
+                results.append({"benchmark": "api_load", "endpoint": endpoint, **({"mode": mode} if mode else {}), **summary})
+                label = f"{endpoint} ({mode})" if mode else endpoint
+                print(f"  {label} x{concurrency}: {summary.get('throughput_rps')} req/s, p95 {summary.get('p95_ms')} ms")
+    finally:
+        api.should_exit = True
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Margin call forecaster benchmark suite")
+    parser.add_argument("--chat-latency-ms", type=float, default=300, help="Simulated LLM latency")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Simulated embedding latency")
+    parser.add_argument("--iterations", type=int, default=200, help="Timed calls per micro-benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 1000, 10_000])
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=16, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["models", "faiss", "api", "encoding"])
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/<commit>-<timestamp>.json)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.chdir(PROJECT_DIR)
+
+    fake_server, fake_url = start_fake_server(
+        chat_latency_ms=args.chat_latency_ms, embedding_latency_ms=args.embedding_latency_ms
+    )
+    index_dir = tempfile.mkdtemp(prefix="bench-faiss-")
+    point_at_fake_server(fake_url, index_dir)
+
+    # Build a throwaway FAISS index from the real documents with fake embeddings
+    import rag_index
+    rag_index.FAISS_INDEX_DIR = index_dir
+    rag_index.build_vectorstore()
+
+    import forecaster
+    import main as api_main
+
+    results = []
+    if "encoding" not in args.skip:
+        from bench_client_encoding import run as bench_client_encoding
+        print("⏱️ Client encoding...")
+        results += bench_client_encoding(len(forecaster.current_bundle().client_lookup.codes), [1, 100, 10_000])
+    if "models" not in args.skip:
+        print("⏱️ Model inference...")
+        results += bench_models(forecaster, args.iterations, args.batch_sizes)
+    if "faiss" not in args.skip:
+        print("⏱️ FAISS load and query...")
+        results += bench_faiss(forecaster, args.iterations, args.k)
+    if "api" not in args.skip:
+        print("⏱️ API load...")
+        results += bench_api(api_main.app, forecaster, fake_server, args.concurrency, args.requests)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model_version": forecaster.current_bundle().version,
+            "config": vars(args),
+        },
+        "results": results,
+    }
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ {len(results)} benchmark results written to {output}")
+    fake_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# ensemble.py
+
+import os
+import threading
+import numpy as np
+from sklearn.isotonic import IsotonicRegression
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import log_loss, roc_auc_score, accuracy_score
+
+ENSEMBLE_MODES = ("average", "weighted", "stacking", "cascade")
+DEFAULT_CASCADE_BAND = (0.2, 0.8)
+
+
+# ---- Second-model usage stats (process-wide, survive model reloads) ----
+# skip_fraction is per request, so one large grid or batch call does not outweigh
+# every single-scenario request; the row counts are reported alongside
+class EnsembleStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.second_model_requests = 0
+        self.rows = 0
+        self.second_model_rows = 0
+
+    def record(self, rows, second_model_rows):
+        with self._lock:
+            self.requests += 1
+            self.second_model_requests += int(second_model_rows > 0)
+            self.rows += rows
+            self.second_model_rows += second_model_rows
+
+    def snapshot(self):
+        with self._lock:
+            skipped = self.requests - self.second_model_requests
+            skipped_rows = self.rows - self.second_model_rows
+            return {
+                "requests": self.requests,
+                "second_model_requests": self.second_model_requests,
+                "second_model_skipped": skipped,
+                "skip_fraction": round(skipped / self.requests, 4) if self.requests else 0.0,
+                "rows": self.rows,
+                "second_model_rows": self.second_model_rows,
+                "second_model_skipped_rows": skipped_rows,
+                "row_skip_fraction": round(skipped_rows / self.rows, 4) if self.rows else 0.0,
+            }
+
+ensemble_stats = EnsembleStats()
+
+
+def _logit(p):
+    p = np.clip(np.asarray(p, dtype=np.float64), 1e-6, 1 - 1e-6)
+    return np.log(p / (1 - p))
+
+
+# ---- Combiner ----
+class EnsembleCombiner:
+    def __init__(self, mode="average", weights=(0.5, 0.5), stacker=None, calibrators=None,
+                 lightgbm_calibrator=None, cascade_band=DEFAULT_CASCADE_BAND, threshold=0.5):
+        if mode not in ENSEMBLE_MODES:
+            raise ValueError(f"Unknown ensemble mode '{mode}', expected one of {ENSEMBLE_MODES}")
+        self.mode = mode
+        self.weights = weights
+        self.stacker = stacker
+        # Calibration fitted per combination mode, keyed "weighted" / "stacking"
+        self.calibrators = calibrators or {}
+        self.lightgbm_calibrator = lightgbm_calibrator
+        self.cascade_band = cascade_band
+        self.threshold = threshold
+
+    def with_mode(self, mode):
+        return EnsembleCombiner(mode, self.weights, self.stacker, self.calibrators,
+                                self.lightgbm_calibrator, self.cascade_band, self.threshold)
+
+    def combination_mode(self):
+        # How both probabilities are combined; cascade uses the best fitted combination
+        if self.mode == "cascade":
+            return "stacking" if self.stacker is not None else "weighted"
+        return self.mode
+
+    def combine(self, p_lgbm, p_lstm):
+        p_lgbm, p_lstm = np.asarray(p_lgbm, dtype=np.float64), np.asarray(p_lstm, dtype=np.float64)
+        mode = self.combination_mode()
+        if mode == "average":
+            return (p_lgbm + p_lstm) / 2
+        if mode == "stacking" and self.stacker is not None:
+            combined = self.stacker.predict_proba(np.column_stack([_logit(p_lgbm), _logit(p_lstm)]))[:, 1]
+        else:
+            combined = self.weights[0] * p_lgbm + self.weights[1] * p_lstm
+        calibrator = self.calibrators.get(mode)
+        if calibrator is not None:
+            combined = calibrator.predict(combined)
+        return combined
+
+    def predict(self, feature_matrix, predict_lightgbm, predict_lstm):
+        # predict_* take a feature matrix and return probabilities; the LSTM is only
+        # called for rows that need it
+        p_lgbm = np.asarray(predict_lightgbm(feature_matrix), dtype=np.float64)
+        n_rows = len(p_lgbm)
+
+        if self.mode != "cascade":
+            probabilities = self.combine(p_lgbm, predict_lstm(feature_matrix))
+            ensemble_stats.record(n_rows, n_rows)
+            return probabilities
+
+        # Cascade: the cheap model decides confidently-clear rows on its own
+        p_first = self.lightgbm_calibrator.predict(p_lgbm) if self.lightgbm_calibrator is not None else p_lgbm
+        low, high = self.cascade_band
+        uncertain = (p_first > low) & (p_first < high)
+        probabilities = p_first.copy()
+        if uncertain.any():
+            p_lstm = predict_lstm(feature_matrix[uncertain])
+            probabilities[uncertain] = self.combine(p_lgbm[uncertain], p_lstm)
+        ensemble_stats.record(n_rows, int(uncertain.sum()))
+        return probabilities
+
+
+def default_combiner():
+    band = tuple(float(x) for x in os.getenv("ENSEMBLE_CASCADE_BAND", "0.2,0.8").split(","))
+    return EnsembleCombiner(mode=os.getenv("ENSEMBLE_MODE", "average"), cascade_band=band)
+
+
+def resolve_combiner(fitted=None):
+    # A fitted combiner from the model bundle wins; ENSEMBLE_MODE can still switch its mode
+    if fitted is None:
+        return default_combiner()
+    mode = os.getenv("ENSEMBLE_MODE")
+    return fitted.with_mode(mode) if mode else fitted
+
+
+# ---- Fitting on held-out predictions ----
+# p_lgbm / p_lstm must come from rows neither base model was trained on, and the
+# combiner is evaluated on a later slice than the one it is fitted on
+def fit_combiner(p_lgbm, p_lstm, y, mode="stacking", cascade_band=DEFAULT_CASCADE_BAND):
+    p_lgbm, p_lstm, y = np.asarray(p_lgbm), np.asarray(p_lstm), np.asarray(y)
+
+    # Learned weights: pick the blend with the lowest held-out log loss
+    candidates = np.linspace(0, 1, 21)
+    best_w = min(candidates, key=lambda w: log_loss(y, np.clip(w * p_lgbm + (1 - w) * p_lstm, 1e-6, 1 - 1e-6)))
+    weights = (float(best_w), float(1 - best_w))
+
+    stacker = LogisticRegression()
+    stacker.fit(np.column_stack([_logit(p_lgbm), _logit(p_lstm)]), y)
+
+    combiner = EnsembleCombiner(mode=mode, weights=weights, stacker=stacker, cascade_band=cascade_band)
+    for calibrated_mode in ("weighted", "stacking"):
+        raw = combiner.with_mode(calibrated_mode).combine(p_lgbm, p_lstm)
+        combiner.calibrators[calibrated_mode] = IsotonicRegression(out_of_bounds="clip").fit(raw, y)
+    combiner.lightgbm_calibrator = IsotonicRegression(out_of_bounds="clip").fit(p_lgbm, y)
+    return combiner
+
+
+def evaluate_combiner(combiner, p_lgbm, p_lstm, y):
+    p = combiner.combine(p_lgbm, p_lstm)
+    return {
+        "log_loss": round(float(log_loss(y, np.clip(p, 1e-6, 1 - 1e-6))), 4),
+        "roc_auc": round(float(roc_auc_score(y, p)), 4),
+        "accuracy": round(float(accuracy_score(y, p > combiner.threshold)), 4),
+    }
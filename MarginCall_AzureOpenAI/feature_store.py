@@ -0,0 +1,345 @@
+# feature_store.py
+
+import os
+import fcntl
+import shutil
+import tempfile
+from contextlib import contextmanager
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sklearn.preprocessing import LabelEncoder
+
+# Margin history is ingested once from CSV into a Parquet dataset partitioned by month.
+# Training, indexing and serving all read from here and share one client encoder.
+# Only the CLI (python feature_store.py), the trainers and rag_index.py ingest; serving
+# processes just read the store.
+# margin_call_training_data_1000.csv is opt-in: its millions scale and client codes are
+# assumptions, add it with MARGIN_DATA_SOURCES=MarginCallData.csv,margin_call_training_data_1000.csv
+SOURCE_CSVS = [
+    p.strip() for p in os.getenv("MARGIN_DATA_SOURCES", "MarginCallData.csv").split(",") if p.strip()
+]
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "feature_store")
+# Lists the ingested sources; files starting with "_" are skipped by Parquet dataset reads
+SOURCES_MANIFEST = "_sources.txt"
+# The client encoder lives inside the store it was fitted on, so a scratch store never
+# replaces the live store's encoder and both are swapped in together
+CLIENT_ENCODER_FILE = "_client_label_encoder.joblib"
+# Share of the most recent dates the base model trainers never fit on; the ensemble
+# combiner is fitted and evaluated on these dates
+HOLDOUT_FRACTION = float(os.getenv("HOLDOUT_FRACTION", 0.2))
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 100_000))
+
+
+def client_encoder_path(store_dir=FEATURE_STORE_DIR):
+    return os.path.join(store_dir, CLIENT_ENCODER_FILE)
+
+CLIENT_ENCODER_PATH = client_encoder_path()
+
+NUMERIC_FEATURES = ["MTM", "Collateral", "Threshold", "Volatility", "InterestRate", "MTA"]
+FEATURES = ["Client_Encoded"] + NUMERIC_FEATURES
+TARGET = "MarginCallMade"
+PARTITION_COLUMN = "Month"
+
+# Normalized store schema: compact dtypes, amounts in currency units
+STORE_SCHEMA = pa.schema([
+    ("Date", pa.timestamp("ms")),
+    ("Client", pa.dictionary(pa.int16(), pa.string())),
+    ("MTM", pa.float32()),
+    ("Collateral", pa.float32()),
+    ("Threshold", pa.float32()),
+    ("Volatility", pa.float32()),
+    ("Currency", pa.dictionary(pa.int8(), pa.string())),
+    ("InterestRate", pa.float32()),
+    ("FXRate", pa.float32()),
+    ("MTA", pa.float32()),
+    (TARGET, pa.int8()),
+    ("MarginCallAmount", pa.float32()),
+    ("Source", pa.dictionary(pa.int8(), pa.string())),
+    (PARTITION_COLUMN, pa.string()),
+])
+AMOUNT_COLUMNS = ["MTM", "Collateral", "Threshold", "MTA", "MarginCallAmount"]
+REQUIRED_COLUMNS = ["Date", "Client"] + NUMERIC_FEATURES + ["Currency", TARGET, "MarginCallAmount"]
+
+# Known source layouts, mapped onto the store schema
+SOURCE_SCHEMAS = {
+    # MarginCallData.csv: amounts in units, long client names
+    "margin_call_data": {
+        "rename": {},
+        "date_format": "%d-%b-%Y",
+        "client_prefix": "",
+        "amount_scale": 1,
+    },
+    # margin_call_training_data_1000.csv: amounts in millions, single-letter client codes
+    "margin_call_training_data": {
+        "rename": {
+            "FX Rate": "FXRate",
+            "Interest Rate": "InterestRate",
+            "Margin Call Made": TARGET,
+            "Margin Call Amt": "MarginCallAmount",
+        },
+        "date_format": "%Y-%m-%d",
+        "client_prefix": "Client",
+        "amount_scale": 1_000_000,
+    },
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def detect_source_schema(csv_path):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    for name, spec in SOURCE_SCHEMAS.items():
+        normalized = {spec["rename"].get(col, col) for col in header}
+        if set(REQUIRED_COLUMNS) <= normalized and set(spec["rename"]) <= set(header):
+            return name
+    raise SchemaError(f"{csv_path}: unrecognized columns {list(header)}")
+
+
+def source_dtypes(spec):
+    # Explicit compact dtypes for read_csv, keyed by the source column names
+    source_names = {v: k for k, v in spec["rename"].items()}
+    dtypes = {col: "float32" for col in NUMERIC_FEATURES + ["FXRate", "MarginCallAmount"]}
+    dtypes.update({"Client": "category", "Currency": "category", TARGET: "category"})
+    return {source_names.get(col, col): dtype for col, dtype in dtypes.items()}
+
+
+def normalize_chunk(chunk, spec, source_name):
+    chunk = chunk.rename(columns=spec["rename"])
+    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise SchemaError(f"{source_name}: missing columns {missing}")
+
+    out = pd.DataFrame(index=chunk.index)
+    out["Date"] = pd.to_datetime(chunk["Date"], format=spec["date_format"], errors="coerce")
+    clients = chunk["Client"].astype(str)
+    if spec["client_prefix"]:
+        clients = clients.where(clients.str.startswith(spec["client_prefix"]), spec["client_prefix"] + clients)
+    out["Client"] = clients
+    for col in NUMERIC_FEATURES + ["MarginCallAmount"]:
+        out[col] = pd.to_numeric(chunk[col], errors="coerce").astype("float32")
+    out["FXRate"] = pd.to_numeric(chunk["FXRate"], errors="coerce").astype("float32") if "FXRate" in chunk else pd.NA
+    for col in AMOUNT_COLUMNS:
+        out[col] = (out[col] * spec["amount_scale"]).astype("float32")
+    out["Currency"] = chunk["Currency"].astype(str)
+    out[TARGET] = chunk[TARGET].astype(str).map({"Yes": 1, "No": 0})
+    out["Source"] = source_name
+
+    # Validate before anything reaches the store
+    invalid = out[["Date", TARGET] + NUMERIC_FEATURES].isna().any(axis=1)
+    if invalid.any():
+        first_bad = int(invalid.idxmax())
+        raise SchemaError(f"{source_name}: {int(invalid.sum())} invalid row(s), first at data row {first_bad + 1}")
+    out[TARGET] = out[TARGET].astype("int8")
+    out[PARTITION_COLUMN] = out["Date"].dt.strftime("%Y-%m")
+
+    return pa.Table.from_pandas(out, schema=STORE_SCHEMA, preserve_index=False)
+
+
+# ---- Ingestion ----
+@contextmanager
+def ingest_lock(store_dir=FEATURE_STORE_DIR):
+    # One ingestion per store at a time, across processes (trainers, CLI, rag_index.py)
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    with open(f"{os.path.abspath(store_dir)}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def ingest_sources(source_paths=None, store_dir=FEATURE_STORE_DIR, chunk_rows=INGEST_CHUNK_ROWS):
+    with ingest_lock(store_dir):
+        return _ingest_sources(source_paths, store_dir, chunk_rows)
+
+
+def _ingest_sources(source_paths, store_dir, chunk_rows=INGEST_CHUNK_ROWS):
+    source_paths = [p for p in (source_paths or SOURCE_CSVS) if os.path.exists(p)]
+    if not source_paths:
+        raise FileNotFoundError("No margin data sources found to ingest")
+
+    # Write into a private staging directory next to the live store and swap it in with
+    # renames, so the live store is never deleted or partially written while readers use it
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=f".{os.path.basename(store_dir)}-staging-")
+    old_dir = f"{tmp_dir}-old"
+
+    # Stream every source in fixed-size chunks, peak memory is bounded by chunk_rows
+    clients = set()
+    total_rows = 0
+    for source_path in source_paths:
+        schema_name = detect_source_schema(source_path)
+        spec = SOURCE_SCHEMAS[schema_name]
+        source_name = os.path.splitext(os.path.basename(source_path))[0]
+        reader = pd.read_csv(source_path, dtype=source_dtypes(spec), chunksize=chunk_rows)
+        for chunk_index, chunk in enumerate(reader):
+            table = normalize_chunk(chunk, spec, source_name)
+            pq.write_to_dataset(
+                table,
+                root_path=tmp_dir,
+                partition_cols=[PARTITION_COLUMN],
+                basename_template=f"{source_name}-{chunk_index}-{{i}}.parquet",
+            )
+            clients.update(table.column("Client").to_pylist())
+            total_rows += table.num_rows
+        print(f"📥 Ingested {source_path} ({schema_name} schema)")
+
+    with open(os.path.join(tmp_dir, SOURCES_MANIFEST), "w") as f:
+        f.write("\n".join(source_paths))
+
+    # The one place the client encoder is fitted
+    client_encoder = LabelEncoder()
+    client_encoder.fit(sorted(clients))
+    joblib.dump(client_encoder, client_encoder_path(tmp_dir))
+
+    if os.path.isdir(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    print(f"📦 Ingested {total_rows} rows from {len(source_paths)} source(s) into '{store_dir}'")
+    return total_rows
+
+
+def ingested_sources(store_dir=FEATURE_STORE_DIR):
+    manifest = os.path.join(store_dir, SOURCES_MANIFEST)
+    if not os.path.exists(manifest):
+        return None
+    with open(manifest) as f:
+        return [line for line in f.read().splitlines() if line]
+
+
+def store_is_stale(source_paths=None, store_dir=FEATURE_STORE_DIR):
+    # Missing, built from other sources or older than any source CSV. Without explicit
+    # sources an existing store keeps the ones it was built from.
+    if source_paths is None:
+        source_paths = ingested_sources(store_dir) or SOURCE_CSVS
+    source_paths = [p for p in source_paths if os.path.exists(p)]
+    stale = (
+        not os.path.isdir(store_dir)
+        or not os.path.exists(client_encoder_path(store_dir))
+        or ingested_sources(store_dir) != source_paths
+        or any(os.path.getmtime(p) > os.path.getmtime(store_dir) for p in source_paths)
+    )
+    return stale, source_paths
+
+
+def ensure_store(source_paths=None, store_dir=FEATURE_STORE_DIR):
+    # Checked again under the lock: processes that waited for another ingestion reuse its result
+    if not store_is_stale(source_paths, store_dir)[0]:
+        return
+    with ingest_lock(store_dir):
+        stale, source_paths = store_is_stale(source_paths, store_dir)
+        if stale:
+            _ingest_sources(source_paths, store_dir)
+
+
+_stale_warned = set()
+
+def require_store(store_dir=FEATURE_STORE_DIR):
+    # Read path: never ingests, so API workers importing forecaster do not race to rebuild it
+    if not os.path.exists(client_encoder_path(store_dir)):
+        raise FileNotFoundError(f"Feature store '{store_dir}' not found, run `python feature_store.py` first")
+    if store_dir not in _stale_warned and store_is_stale(store_dir=store_dir)[0]:
+        _stale_warned.add(store_dir)
+        print(f"⚠️ Feature store '{store_dir}' is older than its source CSVs, run `python feature_store.py` to refresh it")
+
+
+# ---- Reads ----
+def load_features(columns=None, clients=None, start_date=None, end_date=None, sources=None,
+                  store_dir=FEATURE_STORE_DIR):
+    require_store(store_dir)
+
+    # Month filters prune whole partitions, the rest are pushed down to the row groups
+    filters = []
+    if clients:
+        filters.append(("Client", "in", list(clients)))
+    if sources:
+        filters.append(("Source", "in", list(sources)))
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        filters.append((PARTITION_COLUMN, ">=", start_date.strftime("%Y-%m")))
+        filters.append(("Date", ">=", start_date))
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        filters.append((PARTITION_COLUMN, "<=", end_date.strftime("%Y-%m")))
+        filters.append(("Date", "<=", end_date))
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(["Date"] + list(columns)))
+
+    df = pq.read_table(store_dir, columns=read_columns, filters=filters or None).to_pandas()
+
+    # Partitioned reads come back grouped by month, restore chronological order
+    df = df.sort_values(["Date"], kind="stable").reset_index(drop=True)
+    if columns is not None:
+        df = df[list(columns)]
+    else:
+        df = df.drop(columns=[PARTITION_COLUMN])
+    return df
+
+
+def time_based_split(df, holdout_fraction=HOLDOUT_FRACTION):
+    # Whole dates go to one side, the holdout is strictly later than training
+    dates = np.sort(df["Date"].unique())
+    cutoff = dates[int(len(dates) * (1 - holdout_fraction))]
+    train_mask = (df["Date"] < cutoff).to_numpy()
+    return train_mask, cutoff
+
+
+def load_client_encoder(store_dir=FEATURE_STORE_DIR):
+    require_store(store_dir)
+    return joblib.load(client_encoder_path(store_dir))
+
+
+def encode_clients(clients, client_encoder=None):
+    client_encoder = client_encoder or load_client_encoder()
+    return client_encoder.transform(pd.Series(clients).astype(str))
+
+
+# ---- Serving-side Client Lookup ----
+# Unseen clients map to a fallback bucket instead of failing: a known client name, an
+# integer code, or (default) a dedicated code one past the last known client
+UNSEEN_CLIENT_FALLBACK = os.getenv("UNSEEN_CLIENT_FALLBACK", "")
+
+
+class ClientCodeLookup:
+    def __init__(self, client_encoder, fallback=UNSEEN_CLIENT_FALLBACK):
+        # Built once per model bundle; a dict lookup replaces LabelEncoder.transform per request
+        self.codes = {client: code for code, client in enumerate(client_encoder.classes_)}
+        if fallback in self.codes:
+            self.fallback_code = self.codes[fallback]
+        elif str(fallback).lstrip("-").isdigit():
+            self.fallback_code = int(fallback)
+        else:
+            self.fallback_code = len(self.codes)
+        self.unseen_clients = set()
+
+    def encode(self, clients):
+        codes, fallback = self.codes, self.fallback_code
+        encoded = np.fromiter((codes.get(client, fallback) for client in clients), dtype=np.float64)
+        if (encoded == fallback).any():
+            for client in clients:
+                if client not in codes and client not in self.unseen_clients:
+                    self.unseen_clients.add(client)
+                    print(f"⚠️ Unseen client '{client}', using fallback code {fallback}")
+        return encoded
+
+
+def feature_matrix(df, client_encoder=None):
+    # Returns X in FEATURES order, plus y when the target column is present
+    X = df[NUMERIC_FEATURES].copy()
+    X.insert(0, "Client_Encoded", encode_clients(df["Client"], client_encoder))
+    y = df[TARGET] if TARGET in df.columns else None
+    return X, y
+
+
+if __name__ == "__main__":
+    ingest_sources()
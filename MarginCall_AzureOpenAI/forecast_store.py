@@ -0,0 +1,64 @@
+# forecast_store.py
+
+import os
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+# Precomputed forecasts, one row per client / as-of date / horizon. The fingerprint
+# covers everything the forecast was computed from (scenario inputs, model version,
+# ensemble mode, retrieval index), so a stored row is only served while all of them are unchanged.
+FORECAST_STORE_PATH = os.getenv("FORECAST_STORE_PATH", "forecast_store.sqlite")
+
+
+def connect(path=FORECAST_STORE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    # WAL lets API workers read while the precompute job writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS forecasts (
+            client TEXT,
+            as_of TEXT,
+            horizon INTEGER,
+            fingerprint TEXT,
+            model_version TEXT,
+            source TEXT,
+            payload TEXT,
+            created_at TEXT,
+            PRIMARY KEY (client, as_of, horizon)
+        )
+    """)
+    return conn
+
+
+def load_forecast(client, as_of, horizon, fingerprint, path=FORECAST_STORE_PATH):
+    # Returns the stored forecast, or None when missing or computed from other inputs/models
+    if not os.path.exists(path):
+        return None
+    conn = connect(path)
+    row = conn.execute(
+        "SELECT payload FROM forecasts WHERE client = ? AND as_of = ? AND horizon = ? AND fingerprint = ?",
+        (client, as_of, horizon, fingerprint),
+    ).fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def save_forecast(client, as_of, horizon, fingerprint, model_version, forecast, source, path=FORECAST_STORE_PATH):
+    # source: "precompute" (scheduled job) or "on_demand" (computed by /forecast on a miss)
+    conn = connect(path)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (client, as_of, horizon, fingerprint, model_version, source, json.dumps(forecast),
+             datetime.now(timezone.utc).isoformat()),
+        )
+    conn.close()
+
+
+def prune_forecasts(before_as_of, path=FORECAST_STORE_PATH):
+    conn = connect(path)
+    with conn:
+        deleted = conn.execute("DELETE FROM forecasts WHERE as_of < ?", (before_as_of,)).rowcount
+    conn.close()
+    return deleted
@@ -1,46 +1,91 @@
 import os
 import re
+import json
+import zlib
+import hashlib
+import time
+import threading
 from datetime import datetime, timedelta
 import numpy as np
 import pandas as pd
 import torch
 import joblib
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
 from torch import nn
+from llm_clients import get_chat_llm, get_embedding_model
+from feature_store import FEATURES, NUMERIC_FEATURES, ClientCodeLookup, load_features
+from model_registry import resolve_artifacts, current_version, missing_artifacts, IncompleteBundleError
+from ensemble import resolve_combiner
+from telemetry import stage_span, PROMPT_CONTEXT_ROWS, FORECAST_STORE_LOOKUPS
+from forecast_store import load_forecast, save_forecast
+from prompt_builder import build_prompt, PROMPT_TOKEN_BUDGET
+from margin_engine import margin_calls, margin_call_records
+from retrieval import (
+    BM25Index, BM25_INDEX_FILE, CORPUS_FILE, CachedQueryEmbeddings, HybridRetriever, load_corpus,
+    explanation_retrieval_query
+)
 
 load_dotenv()
 
-# Initialize LLM
-llm = AzureChatOpenAI(
-    azure_deployment=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version=os.getenv("AZURE_OPENAI_CHAT_API_VERSION"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    temperature=0
-)
+# Business date forecasts and explanations are for. Pin it (YYYY-MM-DD) to make runs
+# reproducible, e.g. replaying recorded LLM calls in CI, whose prompts include the date
+FORECAST_AS_OF_DATE = os.getenv("FORECAST_AS_OF_DATE")
+_pinned_as_of = datetime.strptime(FORECAST_AS_OF_DATE, "%Y-%m-%d") if FORECAST_AS_OF_DATE else None
 
-# Embedding model
-embedding_model = AzureOpenAIEmbeddings(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION"),
-    deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
-)
+def as_of_date():
+    return _pinned_as_of or datetime.today()
 
-# Load FAISS vectorstore
-def load_local_vectorstore():
-    return FAISS.load_local(
-        "faiss_index",
-        embedding_model,
-        allow_dangerous_deserialization=True
-    )
+# Shared LLM and embedding clients; repeated retrieval queries reuse their embedding
+llm = get_chat_llm()
+embedding_model = CachedQueryEmbeddings(get_embedding_model())
 
-# Load Models and Encoders
-lightgbm_model = joblib.load("margin_call_lightgbm_model.joblib")
-client_encoder = joblib.load("client_label_encoder.joblib")
+# Load FAISS vectorstore and the BM25 index built next to it
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_index")
+# Explanation prompts name the client and fields, which keyword search handles without
+# an embeddings round trip; free-text questions use both
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "sparse")
+ASK_RETRIEVAL_MODE = os.getenv("ASK_RETRIEVAL_MODE", "hybrid")
+
+def load_local_vectorstore():
+    with stage_span("vectorstore_load"):
+        return FAISS.load_local(
+            FAISS_INDEX_DIR,
+            embedding_model,
+            allow_dangerous_deserialization=True
+        )
+
+def load_local_bm25():
+    if os.path.exists(os.path.join(FAISS_INDEX_DIR, BM25_INDEX_FILE)):
+        return BM25Index.load(FAISS_INDEX_DIR)
+    if not os.path.exists(os.path.join(FAISS_INDEX_DIR, CORPUS_FILE)):
+        raise FileNotFoundError(f"No {BM25_INDEX_FILE} or {CORPUS_FILE} in '{FAISS_INDEX_DIR}', re-run rag_index.py")
+    print(f"⚠️ No {BM25_INDEX_FILE} in '{FAISS_INDEX_DIR}', building it from {CORPUS_FILE}")
+    return BM25Index(load_corpus(FAISS_INDEX_DIR))
+
+_index_lock = threading.Lock()
+_indexes = None  # (index file mtime, vector store, bm25), swapped as one tuple
+
+def _index_key():
+    path = os.path.join(FAISS_INDEX_DIR, "index.faiss")
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def get_indexes():
+    # Loaded once per process and reloaded only when rag_index.py rewrites the index
+    global _indexes
+    key = _index_key()
+    indexes = _indexes
+    if indexes is None or indexes[0] != key:
+        with _index_lock:
+            indexes = _indexes
+            if indexes is None or indexes[0] != key:
+                vector_store = load_local_vectorstore()
+                indexes = _indexes = (key, vector_store, load_local_bm25())
+    return indexes[1], indexes[2]
+
+def get_retriever(k, mode=None):
+    vector_store, bm25 = get_indexes()
+    return HybridRetriever(vector_store, bm25, mode=mode or RETRIEVAL_MODE, k=k)
 
 class MarginCallLSTM(nn.Module):
     def __init__(self, input_size, hidden_size, num_layers=1):
@@ -56,70 +101,183 @@ class MarginCallLSTM(nn.Module):
         out = self.fc(out[:, -1, :])
         return self.sigmoid(out)
 
-lstm_model = MarginCallLSTM(7, 64)
-lstm_model.load_state_dict(torch.load("margin_call_lstm_model.pth"))
-lstm_model.eval()
-
-scaler = joblib.load("lstm_scaler.joblib")
-historical_df = pd.read_csv("MarginCallData.csv")
-historical_df["Client_Encoded"] = client_encoder.transform(historical_df["Client"])
-
-features = ["Client_Encoded", "MTM", "Collateral", "Threshold", "Volatility", "InterestRate", "MTA"]
+# ---------- Model Bundle ----------
+# Model, scaler and encoder from one registry version travel together. Requests take
+# a reference to the current bundle once, so a reload never mixes versions mid-request.
+class ModelBundle:
+    def __init__(self, version, lightgbm_model, lstm_model, scaler, client_encoder, ensemble=None):
+        self.version = version
+        self.lightgbm_model = lightgbm_model
+        self.lstm_model = lstm_model
+        self.scaler = scaler
+        self.client_encoder = client_encoder
+        self.client_lookup = ClientCodeLookup(client_encoder)
+        self.ensemble = resolve_combiner(ensemble)
+
+    @classmethod
+    def load(cls, version=None):
+        version, paths = resolve_artifacts(version)
+        missing = missing_artifacts(paths)
+        if missing:
+            raise IncompleteBundleError(
+                f"Model bundle '{version}' is incomplete, missing {missing}: "
+                f"run train_margin_call_lightgbm.py and train_margin_call_lstm.py first"
+            )
+        lstm_model = MarginCallLSTM(7, 64)
+        lstm_model.load_state_dict(torch.load(paths["lstm"]))
+        lstm_model.eval()
+        # The fitted ensemble combiner is optional, without one ENSEMBLE_MODE picks a default
+        ensemble_path = paths.get("ensemble")
+        ensemble = joblib.load(ensemble_path) if ensemble_path and os.path.exists(ensemble_path) else None
+        return cls(
+            version=version,
+            lightgbm_model=joblib.load(paths["lightgbm"]),
+            lstm_model=lstm_model,
+            scaler=joblib.load(paths["scaler"]),
+            client_encoder=joblib.load(paths["client_encoder"]),
+            ensemble=ensemble,
+        )
+
+    def warm_up(self):
+        # Exercise every model once so the first real request does not pay lazy init costs
+        sample = {feature: float(historical_df[feature].median()) for feature in NUMERIC_FEATURES}
+        sample["Client"] = self.client_encoder.classes_[0]
+        feature_matrix = build_feature_matrix([sample], self)
+        predict_lightgbm_matrix(feature_matrix, self)
+        predict_lstm_matrix(feature_matrix, self)
+
+_bundle_lock = threading.Lock()
+_bundle = None
+
+def current_bundle():
+    return _bundle
+
+def reload_models(version=None):
+    # Load and warm up outside the lock, in-flight requests keep using the old bundle;
+    # the swap itself is a single reference assignment
+    global _bundle
+    new_bundle = ModelBundle.load(version)
+    new_bundle.warm_up()
+    with _bundle_lock:
+        previous_version = _bundle.version if _bundle else None
+        _bundle = new_bundle
+    print(f"🔁 Model bundle {previous_version} -> {new_bundle.version}")
+    return new_bundle.version
+
+def start_reload_watcher(interval_seconds):
+    # Each worker process polls the registry pointer and hot-swaps when it moves
+    def watch():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                latest = current_version()
+                if latest and latest != current_bundle().version:
+                    reload_models(latest)
+            except Exception as e:
+                print(f"❌ Model reload failed, keeping {current_bundle().version}: {e}")
+
+    thread = threading.Thread(target=watch, name="model-reload-watcher", daemon=True)
+    thread.start()
+    return thread
+
+# Only the numeric ranges are needed for scenario generation
+historical_df = load_features(columns=NUMERIC_FEATURES)
+
+features = FEATURES
 
 # ---------- Prediction Functions ----------
-def predict_with_lightgbm(input_data):
-    client_encoded = client_encoder.transform([input_data["Client"]])[0]
-    input_features = [
-        client_encoded,
-        input_data["MTM"],
-        input_data["Collateral"],
-        input_data["Threshold"],
-        input_data["Volatility"],
-        input_data["InterestRate"],
-        input_data["MTA"]
-    ]
-    input_array = np.array([input_features])
-    probability = lightgbm_model.predict(input_array)[0]
-    return probability
-
-def predict_with_lstm(input_data):
-    client_encoded = client_encoder.transform([input_data["Client"]])[0]
-    input_features = [
-        client_encoded,
-        input_data["MTM"],
-        input_data["Collateral"],
-        input_data["Threshold"],
-        input_data["Volatility"],
-        input_data["InterestRate"],
-        input_data["MTA"]
-    ]
-    input_array = np.array([input_features])
-    input_array_scaled = scaler.transform(input_array.reshape(1, -1))
-    input_tensor = torch.tensor(input_array_scaled, dtype=torch.float32).unsqueeze(0)
-    probability = lstm_model(input_tensor).detach().numpy()[0][0]
-    return probability
+def build_feature_matrix(input_rows, bundle=None):
+    # Accepts a list of input dicts or a DataFrame, returns an (n, 7) matrix in `features` order
+    bundle = bundle or current_bundle()
+    rows_df = input_rows if isinstance(input_rows, pd.DataFrame) else pd.DataFrame(input_rows)
+    client_encoded = bundle.client_lookup.encode(rows_df["Client"])
+    return np.column_stack([client_encoded, rows_df[NUMERIC_FEATURES].to_numpy(dtype=np.float64)])
+
+def predict_lightgbm_matrix(feature_matrix, bundle=None):
+    bundle = bundle or current_bundle()
+    with stage_span("lightgbm_predict"):
+        return bundle.lightgbm_model.predict(feature_matrix)
+
+def predict_lstm_matrix(feature_matrix, bundle=None):
+    bundle = bundle or current_bundle()
+    with stage_span("lstm_predict"):
+        scaled = bundle.scaler.transform(feature_matrix)
+        input_tensor = torch.tensor(scaled, dtype=torch.float32).unsqueeze(1)
+        with torch.no_grad():
+            return bundle.lstm_model(input_tensor).numpy()[:, 0]
+
+def predict_with_lightgbm(input_data, bundle=None):
+    # A single dict returns a scalar probability, a list/DataFrame of rows returns an array
+    bundle = bundle or current_bundle()
+    if isinstance(input_data, dict):
+        return predict_lightgbm_matrix(build_feature_matrix([input_data], bundle), bundle)[0]
+    return predict_lightgbm_matrix(build_feature_matrix(input_data, bundle), bundle)
+
+def predict_with_lstm(input_data, bundle=None):
+    bundle = bundle or current_bundle()
+    if isinstance(input_data, dict):
+        return predict_lstm_matrix(build_feature_matrix([input_data], bundle), bundle)[0]
+    return predict_lstm_matrix(build_feature_matrix(input_data, bundle), bundle)
+
+def predict_with_ensemble(feature_matrix, bundle=None):
+    # The bundle's combiner decides how (and in cascade mode whether) both models are used
+    bundle = bundle or current_bundle()
+    with stage_span("ensemble_predict"):
+        return bundle.ensemble.predict(
+            feature_matrix,
+            lambda m: predict_lightgbm_matrix(m, bundle),
+            lambda m: predict_lstm_matrix(m, bundle)
+        )
+
+def predict_margin_calls(input_rows, bundle=None):
+    # Batch path: one ensemble call and one vectorized margin computation for all rows,
+    # returns column arrays (bool required, float amount, float confidence in %)
+    bundle = bundle or current_bundle()
+    rows_df = input_rows if isinstance(input_rows, pd.DataFrame) else pd.DataFrame(input_rows)
+    probabilities = predict_with_ensemble(build_feature_matrix(rows_df, bundle), bundle)
+    return margin_calls(
+        probabilities,
+        rows_df["MTM"], rows_df["Collateral"], rows_df["Threshold"], rows_df["MTA"],
+        decision_threshold=bundle.ensemble.threshold
+    )
 
 def hybrid_predict_margin_call(input_data):
-    prob_lgbm = predict_with_lightgbm(input_data)
-    prob_lstm = predict_with_lstm(input_data)
-
-    avg_prob = (prob_lgbm + prob_lstm) / 2
-    margin_call_required = "Yes" if avg_prob > 0.5 else "No"
-    confidence_score = round(avg_prob * 100, 2)
-    if margin_call_required == "Yes":
-        margin_call_amount = max(round(input_data["MTM"] - input_data["Collateral"] - input_data["Threshold"], 2), 0)
-    else:
-        margin_call_amount = 0
+    prediction = margin_call_records(predict_margin_calls([input_data]))[0]
+    return prediction["MarginCallRequired"], prediction["MarginCallAmount"], prediction["ConfidenceScore"]
 
-    return margin_call_required, f"${margin_call_amount:,.2f}", f"{confidence_score:.2f}%"
+# Load the current model bundle at startup
+reload_models()
 
 def clean_comments(text):
     return re.sub(r'\s+', ' ', text).strip()
 
+def answer_with_context(retriever, question, retrieval_query=None, token_budget=PROMPT_TOKEN_BUDGET):
+    # Retrieved rows are deduplicated and compacted into a table that fits the token budget
+    with stage_span("retriever_query"):
+        docs = retriever.invoke(retrieval_query or question)
+    with stage_span("prompt_build"):
+        prompt = build_prompt(question, docs, token_budget)
+    PROMPT_CONTEXT_ROWS.labels(outcome="used").inc(prompt.rows_used)
+    PROMPT_CONTEXT_ROWS.labels(outcome="duplicate").inc(prompt.duplicates)
+    PROMPT_CONTEXT_ROWS.labels(outcome="over_budget").inc(prompt.rows_retrieved - prompt.duplicates - prompt.rows_used)
+
+    with stage_span("llm_answer"):
+        message = llm.invoke(prompt.text)
+    usage = message.response_metadata.get("token_usage") or {}
+    print(
+        f"🧮 Prompt {usage.get('prompt_tokens', prompt.tokens)} tokens (budget {token_budget}), "
+        f"completion {usage.get('completion_tokens', '?')} tokens, "
+        f"{prompt.rows_used}/{prompt.rows_retrieved} rows ({prompt.duplicates} duplicates)"
+    )
+    return message.content
+
 # ---------- Input Generator ----------
 def generate_dynamic_inputs(historical_df, n_days=3, client_name=None):
-    if client_name:
-        np.random.seed(abs(hash(client_name)) % (2**32))
+    # Own RandomState per call: same stream as seeding the global one, but concurrent
+    # forecasts (precompute workers, API threads) cannot reseed each other mid-draw.
+    # crc32, not hash(): str hashes are salted per process, which made the scenario
+    # (and any recorded LLM call for it) change on every restart
+    rng = np.random.RandomState(zlib.crc32(client_name.encode("utf-8")) if client_name else None)
 
     inputs = []
     for _ in range(n_days):
@@ -127,7 +285,7 @@ def generate_dynamic_inputs(historical_df, n_days=3, client_name=None):
         for feature in ["MTM", "Collateral", "Threshold", "Volatility", "InterestRate", "MTA"]:
             min_val = historical_df[feature].min()
             max_val = historical_df[feature].max()
-            sampled_value = np.random.uniform(min_val, max_val)
+            sampled_value = rng.uniform(min_val, max_val)
             if feature in ["MTM", "Collateral", "Threshold"]:
                 sampled_value = round(sampled_value)
             else:
@@ -141,22 +299,72 @@ def generate_dynamic_inputs(historical_df, n_days=3, client_name=None):
 
     return inputs
 
+# ---------- What-If Sensitivity Grid (ML only, no LLM) ----------
+GRID_MODELS = ("hybrid", "lightgbm", "lstm")
+
+def what_if_grid_columns(input_data: dict, mtm_range=None, volatility_range=None, grid_size=50, model="hybrid"):
+    # Flat columns, one entry per grid point (Volatility-major), for columnar responses
+    if model not in GRID_MODELS:
+        raise ValueError(f"Unknown model '{model}', expected one of {GRID_MODELS}")
+
+    mtm_range = mtm_range or (historical_df["MTM"].min(), historical_df["MTM"].max())
+    volatility_range = volatility_range or (historical_df["Volatility"].min(), historical_df["Volatility"].max())
+    mtm_values = np.linspace(mtm_range[0], mtm_range[1], grid_size)
+    volatility_values = np.linspace(volatility_range[0], volatility_range[1], grid_size)
+
+    # Build the whole grid as one feature matrix: rows vary Volatility, columns vary MTM
+    mtm_grid, volatility_grid = np.meshgrid(mtm_values, volatility_values)
+    bundle = current_bundle()
+    feature_matrix = build_feature_matrix([input_data], bundle)
+    feature_matrix = np.repeat(feature_matrix, mtm_grid.size, axis=0)
+    feature_matrix[:, features.index("MTM")] = mtm_grid.ravel()
+    feature_matrix[:, features.index("Volatility")] = volatility_grid.ravel()
+
+    if model == "lightgbm":
+        probabilities = predict_lightgbm_matrix(feature_matrix, bundle)
+    elif model == "lstm":
+        probabilities = predict_lstm_matrix(feature_matrix, bundle)
+    else:
+        probabilities = predict_with_ensemble(feature_matrix, bundle)
+
+    return {
+        "MTM": mtm_grid.ravel().round(2),
+        "Volatility": volatility_grid.ravel().round(2),
+        "Probability": np.asarray(probabilities, dtype=np.float64).round(4)
+    }
+
+def what_if_grid(input_data: dict, mtm_range=None, volatility_range=None, grid_size=50, model="hybrid"):
+    columns = what_if_grid_columns(input_data, mtm_range, volatility_range, grid_size, model)
+    return {
+        "Client": input_data["Client"],
+        "Model": model,
+        "MTM": columns["MTM"][:grid_size].tolist(),
+        "Volatility": columns["Volatility"][::grid_size].tolist(),
+        "Probability": columns["Probability"].reshape(grid_size, grid_size).tolist()
+    }
+
+# ---------- What-If Prediction (ML only, no LLM) ----------
+def hybrid_what_if_prediction(input_data: dict, client_name: str):
+    margin_call_required, margin_call_amount, confidence_score = hybrid_predict_margin_call(input_data)
+
+    return {
+        "Client": client_name,
+        "Date": as_of_date().strftime('%Y-%m-%d'),
+        "MarginCallRequired": margin_call_required,
+        "MarginCallAmount": margin_call_amount,
+        "ConfidenceScore": confidence_score
+    }
+
 # ---------- What-If Analysis ----------
 def hybrid_what_if_one_day(input_data: dict, client_name: str):
     margin_call_required, margin_call_amount, confidence_score = hybrid_predict_margin_call(input_data)
 
-    vector_store = load_local_vectorstore()
-    retriever = vector_store.as_retriever(search_kwargs={"k": 10})
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        return_source_documents=False
-    )
+    retriever = get_retriever(k=10)
 
-    today = datetime.today().strftime('%Y-%m-%d')
+    today = as_of_date().strftime('%Y-%m-%d')
 
     prompt = f"""
-The ML model predicts that a margin call **{'IS' if margin_call_required == 'Yes' else 'is NOT'}** required for client {client_name} today ({today}).
+The ML model predicts that a margin call **{'IS' if margin_call_required else 'is NOT'}** required for client {client_name} today ({today}).
 Prediction Details:
 - MTM: {input_data['MTM']}
 - Collateral: {input_data['Collateral']}
@@ -164,14 +372,16 @@ Prediction Details:
 - Volatility: {input_data['Volatility']}
 - InterestRate: {input_data['InterestRate']}
 - MTA: {input_data['MTA']}
-- Margin Call Required: {margin_call_required}
-- Margin Call Amount: {margin_call_amount}
-- Confidence Score: {confidence_score}
+- Margin Call Required: {'Yes' if margin_call_required else 'No'}
+- Margin Call Amount: {margin_call_amount:,.2f}
+- Confidence Score: {confidence_score:.2f}%
 
 Using historical margin call data, briefly explain the model's prediction in 2-3 lines.
 """
 
-    explanation = qa_chain.run(prompt)
+    explanation = answer_with_context(
+        retriever, prompt, retrieval_query=explanation_retrieval_query(client_name, input_data, margin_call_required)
+    )
 
     return {
         "Client": client_name,
@@ -182,27 +392,28 @@ Using historical margin call data, briefly explain the model's prediction in 2-3
         "Comments": clean_comments(explanation)
     }
 
-# ---------- Forecast for T+1, T+2, T+3 ----------
-def hybrid_forecast_from_history(client_name: str):
-    vector_store = load_local_vectorstore()
-    retriever = vector_store.as_retriever(search_kwargs={"k": 20})
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        return_source_documents=False
-    )
+# ---------- Forecast for T+1 .. T+horizon ----------
+DEFAULT_HORIZON = 3
+
+def hybrid_forecast_from_history(client_name: str, horizon=DEFAULT_HORIZON, simulated_inputs=None, bundle=None):
+    bundle = bundle or current_bundle()
+    retriever = get_retriever(k=20)
 
     forecast_results = []
-    today = datetime.today()
+    today = as_of_date()
 
-    simulated_inputs = generate_dynamic_inputs(historical_df, n_days=3, client_name=client_name)
+    if simulated_inputs is None:
+        simulated_inputs = generate_dynamic_inputs(historical_df, n_days=horizon, client_name=client_name)
+    predictions = margin_call_records(predict_margin_calls(simulated_inputs, bundle))
 
-    for i, input_data in enumerate(simulated_inputs):
+    for i, (input_data, prediction) in enumerate(zip(simulated_inputs, predictions)):
         forecast_date = (today + timedelta(days=i+1)).strftime('%Y-%m-%d')
-        margin_call_required, margin_call_amount, confidence_score = hybrid_predict_margin_call(input_data)
+        margin_call_required = prediction["MarginCallRequired"]
+        margin_call_amount = prediction["MarginCallAmount"]
+        confidence_score = prediction["ConfidenceScore"]
 
         prompt = f"""
-The ML model predicts that a margin call **{'IS' if margin_call_required == 'Yes' else 'is NOT'}** required for client {client_name} on {forecast_date}.
+The ML model predicts that a margin call **{'IS' if margin_call_required else 'is NOT'}** required for client {client_name} on {forecast_date}.
 Prediction Details:
 - MTM: {input_data['MTM']}
 - Collateral: {input_data['Collateral']}
@@ -210,14 +421,16 @@ Prediction Details:
 - Volatility: {input_data['Volatility']}
 - InterestRate: {input_data['InterestRate']}
 - MTA: {input_data['MTA']}
-- Margin Call Required: {margin_call_required}
-- Margin Call Amount: {margin_call_amount}
-- Confidence Score: {confidence_score}
+- Margin Call Required: {'Yes' if margin_call_required else 'No'}
+- Margin Call Amount: {margin_call_amount:,.2f}
+- Confidence Score: {confidence_score:.2f}%
 
 Using historical margin call data, briefly explain the model's prediction in 2-3 lines.
 """
 
-        explanation = qa_chain.run(prompt)
+        explanation = answer_with_context(
+            retriever, prompt, retrieval_query=explanation_retrieval_query(client_name, input_data, margin_call_required)
+        )
 
         forecast_results.append({
             "Client": client_name,
@@ -230,13 +443,70 @@ Using historical margin call data, briefly explain the model's prediction in 2-3
 
     return forecast_results
 
-# ---------- Ask Anything ----------
-def query_llm_ask_anything(query: str):
-    vector_store = load_local_vectorstore()
-    retriever = vector_store.as_retriever(search_kwargs={"k": 20})
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        return_source_documents=False
+# ---------- Precomputed Forecasts ----------
+def forecast_fingerprint(simulated_inputs, bundle):
+    # Everything a stored forecast depends on: the scenario inputs, the model bundle, how
+    # its models are combined (ENSEMBLE_MODE / ENSEMBLE_CASCADE_BAND as resolved for the
+    # bundle) and the retrieval index the explanations were grounded on
+    payload = json.dumps(
+        {
+            "inputs": simulated_inputs,
+            "model_version": bundle.version,
+            "ensemble_mode": bundle.ensemble.mode,
+            "cascade_band": list(bundle.ensemble.cascade_band),
+            "index": _index_key(),
+        },
+        sort_keys=True, default=str
     )
-    return qa_chain.run(query)
\ No newline at end of file
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def stored_forecast(client_name: str, horizon=DEFAULT_HORIZON, refresh=False, source="on_demand"):
+    # Serve from the forecast store when nothing changed since it was computed,
+    # otherwise compute now and store the result for the next request
+    bundle = current_bundle()
+    as_of = as_of_date().strftime('%Y-%m-%d')
+    simulated_inputs = generate_dynamic_inputs(historical_df, n_days=horizon, client_name=client_name)
+    fingerprint = forecast_fingerprint(simulated_inputs, bundle)
+
+    if not refresh:
+        stored = load_forecast(client_name, as_of, horizon, fingerprint)
+        if stored is not None:
+            FORECAST_STORE_LOOKUPS.labels(result="hit").inc()
+            return stored
+        FORECAST_STORE_LOOKUPS.labels(result="miss").inc()
+
+    forecast = hybrid_forecast_from_history(client_name, horizon, simulated_inputs, bundle)
+    save_forecast(client_name, as_of, horizon, fingerprint, bundle.version, forecast, source)
+    return forecast
+
+# ---------- Ask Anything ----------
+ASK_K = 20
+ASK_FOLLOWUP_K = 8
+HISTORY_MAX_TURNS = 6
+HISTORY_MAX_CHARS = 300
+
+def summarize_history(history, max_turns=HISTORY_MAX_TURNS, max_chars=HISTORY_MAX_CHARS):
+    # Keep only the most recent turns, each clipped, so the prompt stays small on long sessions
+    lines = []
+    for turn in history[-max_turns:]:
+        message = clean_comments(str(turn["message"]))
+        if len(message) > max_chars:
+            message = message[:max_chars].rstrip() + "..."
+        lines.append(f"{turn['role']}: {message}")
+    return "\n".join(lines)
+
+def query_llm_ask_anything(query: str, history=None):
+    if not history:
+        retriever = get_retriever(k=ASK_K, mode=ASK_RETRIEVAL_MODE)
+        return answer_with_context(retriever, query)
+
+    # Follow-up: the summarized conversation carries earlier context, so retrieve fewer
+    # documents and retrieve on the new question only
+    retriever = get_retriever(k=ASK_FOLLOWUP_K, mode=ASK_RETRIEVAL_MODE)
+    prompt = f"""
+Conversation so far:
+{summarize_history(history)}
+
+Follow-up question: {query}
+"""
+    return answer_with_context(retriever, prompt, retrieval_query=query)
@@ -0,0 +1,77 @@
+# llm_clients.py
+
+import os
+import threading
+from langchain.agents import Tool, initialize_agent, AgentType
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+from telemetry import llm_usage_callback
+from llm_replay import LLM_REPLAY_MODE, replay_http_client, azure_setting
+
+# Module-level clients are built on first use and reused for the lifetime of the
+# process, so warm Azure Function instances and API workers skip the setup cost.
+_lock = threading.RLock()
+_chat_llm = None
+_embedding_model = None
+_agents = {}
+
+# Token-aware chunking needs tiktoken's encoding, which is downloaded on first use.
+# Recording/replaying never needs it, and the benchmarks turn it off against the fake server
+EMBEDDING_CHECK_CTX_LENGTH = (
+    LLM_REPLAY_MODE == "off"
+    and os.getenv("AZURE_OPENAI_EMBEDDING_CHECK_CTX_LENGTH", "true").lower() in ("1", "true", "yes")
+)
+
+
+def get_chat_llm():
+    global _chat_llm
+    if _chat_llm is None:
+        with _lock:
+            if _chat_llm is None:
+                _chat_llm = AzureChatOpenAI(
+                    azure_deployment=azure_setting("AZURE_OPENAI_CHAT_DEPLOYMENT"),
+                    azure_endpoint=azure_setting("AZURE_OPENAI_ENDPOINT"),
+                    api_version=azure_setting("AZURE_OPENAI_CHAT_API_VERSION"),
+                    api_key=azure_setting("AZURE_OPENAI_API_KEY"),
+                    temperature=0,
+                    callbacks=[llm_usage_callback],
+                    http_client=replay_http_client(),
+                )
+    return _chat_llm
+
+
+def get_embedding_model():
+    global _embedding_model
+    if _embedding_model is None:
+        with _lock:
+            if _embedding_model is None:
+                _embedding_model = AzureOpenAIEmbeddings(
+                    azure_endpoint=azure_setting("AZURE_OPENAI_ENDPOINT"),
+                    api_key=azure_setting("AZURE_OPENAI_API_KEY"),
+                    api_version=azure_setting("AZURE_OPENAI_EMBEDDING_API_VERSION"),
+                    deployment=azure_setting("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+                    http_client=replay_http_client(),
+                    check_embedding_ctx_length=EMBEDDING_CHECK_CTX_LENGTH,
+                )
+    return _embedding_model
+
+
+def get_forecast_agent(forecast_func, description):
+    # One agent per tool description, the tool itself is stateless
+    agent = _agents.get(description)
+    if agent is None:
+        with _lock:
+            agent = _agents.get(description)
+            if agent is None:
+                forecast_tool = Tool(
+                    name="Forecast Tool",
+                    func=forecast_func,
+                    description=description
+                )
+                agent = initialize_agent(
+                    tools=[forecast_tool],
+                    llm=get_chat_llm(),
+                    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+                    verbose=True
+                )
+                _agents[description] = agent
+    return agent
@@ -0,0 +1,116 @@
+# llm_replay.py
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import httpx
+
+# off: talk to Azure OpenAI as usual
+# record: talk to Azure OpenAI and save every successful response
+# replay: never leave the machine, answer from the recordings
+LLM_REPLAY_MODES = ("off", "record", "replay")
+LLM_REPLAY_MODE = os.getenv("LLM_REPLAY_MODE", "off")
+LLM_REPLAY_DIR = os.getenv("LLM_REPLAY_DIR", "llm_recordings")
+# Simulated latency per replayed call, to benchmark with realistic LLM timings
+LLM_REPLAY_LATENCY_MS = float(os.getenv("LLM_REPLAY_LATENCY_MS", 0))
+
+# Replay never reaches Azure, so CI does not need real settings
+REPLAY_AZURE_DEFAULTS = {
+    "AZURE_OPENAI_ENDPOINT": "https://llm-replay.invalid",
+    "AZURE_OPENAI_API_KEY": "replay",
+    "AZURE_OPENAI_CHAT_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_EMBEDDING_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_CHAT_DEPLOYMENT": "replay-chat",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "replay-embedding",
+}
+
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def azure_setting(name):
+    value = os.getenv(name)
+    if not value and LLM_REPLAY_MODE == "replay":
+        return REPLAY_AZURE_DEFAULTS.get(name)
+    return value
+
+
+def request_key(request):
+    # Operation + canonical body only: host, deployment name, api-version and auth
+    # differ between environments but do not change the answer
+    try:
+        body = json.dumps(json.loads(request.content or b"{}"), sort_keys=True, separators=(",", ":"))
+    except ValueError:
+        body = request.content.decode("utf-8", "replace")
+    return hashlib.sha256(f"{request.method} {operation(request)}\n{body}".encode("utf-8")).hexdigest()
+
+
+def operation(request):
+    # /openai/deployments/<deployment>/chat/completions -> chat_completions
+    parts = request.url.path.rstrip("/").split("/")
+    return "_".join(parts[4:]) if len(parts) > 4 else "other"
+
+
+class RecordReplayTransport(httpx.BaseTransport):
+    def __init__(self, mode=LLM_REPLAY_MODE, recordings_dir=LLM_REPLAY_DIR, latency_ms=LLM_REPLAY_LATENCY_MS):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown LLM replay mode '{mode}', expected one of {LLM_REPLAY_MODES}")
+        self.mode = mode
+        self.recordings_dir = recordings_dir
+        self.latency_s = latency_ms / 1000
+        self._upstream = httpx.HTTPTransport(retries=0) if mode == "record" else None
+
+    def _path(self, request):
+        return os.path.join(self.recordings_dir, operation(request), f"{request_key(request)}.json")
+
+    def handle_request(self, request):
+        path = self._path(request)
+
+        if self.mode == "replay":
+            if not os.path.exists(path):
+                # 404 is not retried by the OpenAI client, so a miss fails fast
+                return httpx.Response(404, json={"error": {
+                    "code": "ReplayMiss",
+                    "message": f"No recorded response for {request.method} {request.url.path} ({os.path.basename(path)}), "
+                               f"record it with LLM_REPLAY_MODE=record",
+                }}, request=request)
+            with open(path) as f:
+                recording = json.load(f)
+            if self.latency_s:
+                time.sleep(self.latency_s)
+            return httpx.Response(
+                recording["status_code"], headers=recording["headers"], json=recording["response"], request=request
+            )
+
+        response = self._upstream.handle_request(request)
+        content = response.read()
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS}
+        if response.status_code == 200:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            recording = {
+                "request": json.loads(request.content or b"{}"),
+                "status_code": response.status_code,
+                "headers": {k: v for k, v in headers.items() if k.lower() == "content-type"},
+                "response": json.loads(content),
+            }
+            # Unique temp file per writer: identical concurrent calls each write their own
+            # copy and the last rename wins, readers only ever see a complete recording
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(recording, f, indent=2)
+            os.replace(tmp_path, path)
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def close(self):
+        if self._upstream is not None:
+            self._upstream.close()
+
+
+def replay_http_client(mode=None):
+    # httpx client for the langchain/OpenAI clients, or None to keep their default
+    mode = mode or LLM_REPLAY_MODE
+    if mode == "off":
+        return None
+    print(f"📼 LLM calls in {mode} mode ({LLM_REPLAY_DIR})")
+    return httpx.Client(transport=RecordReplayTransport(mode), timeout=httpx.Timeout(60.0))
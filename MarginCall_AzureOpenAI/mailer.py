@@ -0,0 +1,164 @@
+# mailer.py
+
+import os
+import logging
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+from typing import List, Optional, Tuple, Union
+
+
+# ---- Message Building ----
+@dataclass
+class Attachment:
+    filename: str
+    content: Union[str, bytes]
+    subtype: str = "plain"
+
+
+@dataclass
+class OutgoingMail:
+    receiver_email: str
+    subject: str
+    html_body: str
+    attachments: List[Attachment] = field(default_factory=list)
+
+
+def render_forecast_html(body_text, footer_html="", signature="Margin Call Agent"):
+    body_text_html = body_text.replace('\n', '<br>')
+    return f"""
+    <html>
+        <body>
+            <h2>📊 Margin Call Forecast Summary</h2>
+            <p>{body_text_html}</p>
+            {footer_html}
+            <p>Regards,<br>{signature}</p>
+        </body>
+    </html>
+    """
+
+
+def build_mime_message(sender_email, mail: OutgoingMail):
+    msg = MIMEMultipart()
+    msg["From"] = sender_email
+    msg["To"] = mail.receiver_email
+    msg["Subject"] = mail.subject
+    msg.attach(MIMEText(mail.html_body, "html"))
+
+    # Attachments come straight from memory, nothing is re-read from disk
+    for attachment in mail.attachments:
+        if isinstance(attachment.content, bytes):
+            part = MIMEApplication(attachment.content, _subtype=attachment.subtype)
+        else:
+            part = MIMEText(attachment.content, attachment.subtype)
+        part.add_header("Content-Disposition", "attachment", filename=attachment.filename)
+        msg.attach(part)
+
+    return msg
+
+
+# ---- Dispatcher ----
+class MailDispatcher:
+    def __init__(self, smtp_server, smtp_port, sender_email, sender_password=None,
+                 use_ssl=True, max_connections=4, messages_per_connection=50, timeout=30):
+        self.smtp_server = smtp_server
+        self.smtp_port = int(smtp_port)
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.use_ssl = use_ssl
+        self.max_connections = max(1, int(max_connections))
+        self.messages_per_connection = max(1, int(messages_per_connection))
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            smtp_server=os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+            smtp_port=int(os.getenv("SMTP_PORT", 465)),
+            sender_email=os.getenv("GMAIL_EMAIL"),
+            sender_password=os.getenv("GMAIL_APP_PASSWORD"),
+            use_ssl=os.getenv("SMTP_USE_SSL", "true").lower() in ("1", "true", "yes"),
+            max_connections=int(os.getenv("SMTP_MAX_CONNECTIONS", 4)),
+            messages_per_connection=int(os.getenv("SMTP_MESSAGES_PER_CONNECTION", 50)),
+        )
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        server = smtp_class(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        # Local stand-ins (e.g. aiosmtpd) run without auth
+        if self.sender_password:
+            server.login(self.sender_email, self.sender_password)
+        return server
+
+    def _send_chunk(self, mails) -> List[Tuple[OutgoingMail, Optional[Exception]]]:
+        results = []
+        server = None
+        sent_on_connection = 0
+        try:
+            for mail in mails:
+                msg = build_mime_message(self.sender_email, mail)
+                try:
+                    if server is None or sent_on_connection >= self.messages_per_connection:
+                        self._close(server)
+                        server = self._connect()
+                        sent_on_connection = 0
+                    try:
+                        server.send_message(msg)
+                    except smtplib.SMTPServerDisconnected:
+                        # Provider dropped an idle connection, reconnect once and retry
+                        self._close(server)
+                        server = self._connect()
+                        sent_on_connection = 0
+                        server.send_message(msg)
+                    sent_on_connection += 1
+                    results.append((mail, None))
+                except Exception as e:
+                    logging.error(f"❌ Failed to send email to {mail.receiver_email}: {e}")
+                    results.append((mail, e))
+                    # SMTPException subclasses OSError: refused recipients or rejected data
+                    # leave the connection usable, only a dropped connection or socket error does not
+                    if self._connection_lost(e):
+                        self._close(server)
+                        server = None
+        finally:
+            self._close(server)
+        return results
+
+    @staticmethod
+    def _connection_lost(error):
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+    @staticmethod
+    def _close(server):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            # quit() needs a live connection, still release the socket
+            server.close()
+
+    def send(self, mails: List[OutgoingMail]) -> List[Tuple[OutgoingMail, Optional[Exception]]]:
+        if not mails:
+            return []
+        if not self.sender_email:
+            raise ValueError("GMAIL_EMAIL not set in environment variables")
+
+        # One authenticated connection per worker, at most max_connections in parallel
+        n_workers = min(self.max_connections, len(mails))
+        chunks = [mails[i::n_workers] for i in range(n_workers)]
+
+        if n_workers == 1:
+            results = self._send_chunk(chunks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                results = [r for chunk_results in pool.map(self._send_chunk, chunks) for r in chunk_results]
+
+        sent = sum(1 for _, error in results if error is None)
+        logging.info(f"✅ Sent {sent}/{len(mails)} emails over {n_workers} connection(s)")
+        return results
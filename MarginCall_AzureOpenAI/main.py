@@ -1,15 +1,64 @@
 # main.py
 
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import List
+import os
+import secrets
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from forecaster import (
+    what_if_grid,
+    what_if_grid_columns,
+    predict_margin_calls,
+    hybrid_what_if_prediction,
     hybrid_what_if_one_day,
-    hybrid_forecast_from_history,
-    query_llm_ask_anything
+    stored_forecast,
+    as_of_date,
+    query_llm_ask_anything,
+    current_bundle,
+    reload_models,
+    start_reload_watcher
 )
+from model_registry import read_manifest, activate_version
+from ensemble import ensemble_stats
+from telemetry import setup_tracing, request_span, metrics_payload
+from serialization import ORJSONResponse, columnar_response, negotiate_format
+from single_flight import SingleFlight
 
-app = FastAPI()
+# Every worker polls the registry's CURRENT pointer and hot-swaps when it moves; that is how
+# /admin/reload-models reaches all workers. 0 disables it (single-worker deployments only)
+MODEL_RELOAD_INTERVAL_SECONDS = float(os.getenv("MODEL_RELOAD_INTERVAL_SECONDS", 10))
+
+# Admin endpoints need this token in the X-Admin-Token header, they are disabled while it is unset
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+@asynccontextmanager
+async def lifespan(app):
+    if MODEL_RELOAD_INTERVAL_SECONDS > 0:
+        start_reload_watcher(MODEL_RELOAD_INTERVAL_SECONDS)
+    yield
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_API_TOKEN to enable them")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+# OpenTelemetry export is opt-in via OTEL_EXPORTER_OTLP_ENDPOINT (e.g. http://localhost:4318)
+setup_tracing()
+
+# Latency per route template (not raw path) so /metrics label cardinality stays bounded
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    with request_span("unmatched", request.method) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            span["endpoint"] = route.path
+        span["status"] = response.status_code
+    return response
 
 # Input schema for What-If
 class WhatIfInput(BaseModel):
@@ -21,13 +70,43 @@ class WhatIfInput(BaseModel):
     InterestRate: float
     MTA: float
 
-# Input schema for Forecast
+# Input schema for What-If Grid: base scenario plus the MTM x Volatility ranges to sweep
+class WhatIfGridInput(WhatIfInput):
+    MTMRange: Optional[List[float]] = Field(default=None, min_length=2, max_length=2)
+    VolatilityRange: Optional[List[float]] = Field(default=None, min_length=2, max_length=2)
+    GridSize: int = Field(default=50, ge=2, le=200)
+    Model: str = "hybrid"
+
+# Input schema for bulk scoring: one list per field (columnar), all the same length
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS", 1_000_000))
+
+class WhatIfBatchInput(BaseModel):
+    Client: List[str] = Field(min_length=1, max_length=MAX_BATCH_ROWS)
+    MTM: List[float] = Field(max_length=MAX_BATCH_ROWS)
+    Collateral: List[float] = Field(max_length=MAX_BATCH_ROWS)
+    Threshold: List[float] = Field(max_length=MAX_BATCH_ROWS)
+    Volatility: List[float] = Field(max_length=MAX_BATCH_ROWS)
+    InterestRate: List[float] = Field(max_length=MAX_BATCH_ROWS)
+    MTA: List[float] = Field(max_length=MAX_BATCH_ROWS)
+
+# Input schema for Forecast, Horizon is the number of days ahead (T+1 .. T+Horizon)
 class ForecastInput(BaseModel):
     Client: str
+    Horizon: int = Field(default=3, ge=1, le=30)
+
+# Input schema for model reloads, no version means the registry's CURRENT version.
+# Versions look like v20250101-120000-000000, path-like values are rejected before any lookup
+class ReloadInput(BaseModel):
+    version: Optional[str] = Field(default=None, max_length=64, pattern=r"^[A-Za-z0-9_-]+$")
+
+# Input schema for Ask Anything, history is optional compact context for follow-ups
+class ChatTurn(BaseModel):
+    role: str
+    message: str
 
-# Input schema for Ask Anything
 class AskInput(BaseModel):
     query: str
+    history: List[ChatTurn] = []
 
 # ---------- Endpoint 1: What-If Margin Call Analysis (One Day) ----------
 @app.post("/what-if")
@@ -44,14 +123,118 @@ def what_if_analysis(input_data: WhatIfInput):
     result = hybrid_what_if_one_day(input_dict, client_name=input_data.Client)
     return {"response": result}
 
+# ---------- Endpoint 1b: What-If Prediction Only (fast, no LLM) ----------
+@app.post("/what-if/predict")
+def what_if_prediction(input_data: WhatIfInput):
+    input_dict = {
+        "Client": input_data.Client,
+        "MTM": input_data.MTM,
+        "Collateral": input_data.Collateral,
+        "Threshold": input_data.Threshold,
+        "Volatility": input_data.Volatility,
+        "InterestRate": input_data.InterestRate,
+        "MTA": input_data.MTA
+    }
+    result = hybrid_what_if_prediction(input_dict, client_name=input_data.Client)
+    return {"response": result}
+
+# ---------- Endpoint 1c: What-If Sensitivity Grid (vectorized, no LLM) ----------
+# Bulk endpoints negotiate the response format from the Accept header:
+# application/vnd.apache.arrow.stream, application/msgpack, or JSON (default)
+@app.post("/what-if/grid")
+def what_if_sensitivity_grid(input_data: WhatIfGridInput, request: Request):
+    input_dict = {
+        "Client": input_data.Client,
+        "MTM": input_data.MTM,
+        "Collateral": input_data.Collateral,
+        "Threshold": input_data.Threshold,
+        "Volatility": input_data.Volatility,
+        "InterestRate": input_data.InterestRate,
+        "MTA": input_data.MTA
+    }
+    grid_args = dict(
+        mtm_range=input_data.MTMRange,
+        volatility_range=input_data.VolatilityRange,
+        grid_size=input_data.GridSize,
+        model=input_data.Model
+    )
+    accept = request.headers.get("accept")
+    try:
+        # Plain JSON keeps the nested MTM x Volatility shape the UI heatmap uses
+        if negotiate_format(accept) == "json":
+            return {"response": what_if_grid(input_dict, **grid_args)}
+        columns = what_if_grid_columns(input_dict, **grid_args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return columnar_response(accept, columns, metadata={"Client": input_data.Client, "Model": input_data.Model})
+
+# ---------- Endpoint 1d: Bulk Margin Call Scoring (vectorized, no LLM) ----------
+@app.post("/what-if/batch")
+def what_if_batch(input_data: WhatIfBatchInput, request: Request):
+    rows = input_data.model_dump()
+    lengths = {name: len(values) for name, values in rows.items()}
+    if len(set(lengths.values())) != 1:
+        raise HTTPException(status_code=400, detail=f"All columns must have the same length, got {lengths}")
+    columns = predict_margin_calls(rows)
+    return columnar_response(
+        request.headers.get("accept"),
+        {"Client": rows["Client"], **columns},
+        metadata={"ModelVersion": current_bundle().version}
+    )
+
 # ---------- Endpoint 2: Forecast Using Historical Data ----------
+# Identical forecasts requested at the same time (e.g. the whole desk at market open)
+# share one computation instead of each running the same retrievals and LLM calls
+forecast_flight = SingleFlight("forecast")
+
 @app.post("/forecast")
 def forecast_margin_calls(input_data: ForecastInput):
-    result = hybrid_forecast_from_history(client_name=input_data.Client)
+    # Served from the precomputed forecast store unless inputs or models changed since
+    key = (input_data.Client, as_of_date().strftime('%Y-%m-%d'), current_bundle().version, input_data.Horizon)
+    result = forecast_flight.do(
+        key, lambda: stored_forecast(client_name=input_data.Client, horizon=input_data.Horizon)
+    )
     return {"response": result}
 
 # ---------- Endpoint 3: Ask Anything ----------
 @app.post("/ask")
 def ask_anything(input_data: AskInput):
-    result = query_llm_ask_anything(input_data.query)
-    return {"response": result}
\ No newline at end of file
+    history = [turn.model_dump() for turn in input_data.history]
+    result = query_llm_ask_anything(input_data.query, history=history)
+    return {"response": result}
+
+# ---------- Model Registry: current bundle and hot reload ----------
+@app.get("/models/current")
+def current_model_version():
+    version = current_bundle().version
+    manifest = read_manifest(version) if version != "legacy" else None
+    return {"response": {"version": version, "manifest": manifest}}
+
+@app.post("/admin/reload-models", dependencies=[Depends(require_admin_token)])
+def reload_model_bundle(input_data: ReloadInput):
+    # Load here first so a broken version is rejected before the pointer moves, then
+    # activate it: the other workers' watchers pick it up from CURRENT instead of
+    # reverting this worker on their next poll
+    try:
+        version = reload_models(input_data.version)
+        if input_data.version:
+            activate_version(version)
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Reload failed, still serving {current_bundle().version}: {e}")
+    return {"response": {
+        "version": version,
+        "other_workers": f"within {MODEL_RELOAD_INTERVAL_SECONDS:g}s" if MODEL_RELOAD_INTERVAL_SECONDS > 0
+                         else "not synced, model watcher disabled"
+    }}
+
+# ---------- Ensemble: how often the second model is skipped ----------
+@app.get("/ensemble/stats")
+def ensemble_usage_stats():
+    ensemble = current_bundle().ensemble
+    return {"response": {"mode": ensemble.mode, "cascade_band": ensemble.cascade_band, **ensemble_stats.snapshot()}}
+
+# ---------- Metrics: Prometheus scrape endpoint ----------
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
@@ -0,0 +1,47 @@
+# margin_engine.py
+
+import os
+import numpy as np
+
+# Delivery amounts are rounded to this increment (0.01 = cents; CSAs often use 10,000)
+MARGIN_CALL_ROUNDING = float(os.getenv("MARGIN_CALL_ROUNDING", 0.01))
+# "nearest", or "up"/"down" for CSAs that round delivery amounts in one direction
+MARGIN_CALL_ROUNDING_MODE = os.getenv("MARGIN_CALL_ROUNDING_MODE", "nearest")
+ROUNDING_MODES = {"nearest": np.round, "up": np.ceil, "down": np.floor}
+
+
+def round_to_increment(amounts, increment=MARGIN_CALL_ROUNDING, mode=MARGIN_CALL_ROUNDING_MODE):
+    if mode not in ROUNDING_MODES:
+        raise ValueError(f"Unknown rounding mode '{mode}', expected one of {tuple(ROUNDING_MODES)}")
+    # Trim float noise first so 1234.00 / 0.01 does not ceil to 123401
+    units = np.round(np.asarray(amounts, dtype=np.float64) / increment, 9)
+    return np.round(ROUNDING_MODES[mode](units) * increment, 10)
+
+
+def delivery_amounts(mtm, collateral, threshold, mta, increment=MARGIN_CALL_ROUNDING, mode=MARGIN_CALL_ROUNDING_MODE):
+    # Exposure above collateral and the unsecured threshold; transfers below MTA are not called
+    mtm, collateral, threshold, mta = (np.asarray(x, dtype=np.float64) for x in (mtm, collateral, threshold, mta))
+    amounts = np.maximum(mtm - collateral - threshold, 0.0)
+    amounts = np.where(amounts >= mta, amounts, 0.0)
+    return round_to_increment(amounts, increment, mode)
+
+
+def margin_calls(probabilities, mtm, collateral, threshold, mta, decision_threshold=0.5):
+    # Arrays in, arrays out: the model decides whether a call is expected, the
+    # CSA terms decide how much it is for
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    required = probabilities > decision_threshold
+    amounts = np.where(required, delivery_amounts(mtm, collateral, threshold, mta), 0.0)
+    # Nothing to deliver (below MTA or rounded away) means no call, whatever the model says
+    required = required & (amounts > 0)
+    return {
+        "MarginCallRequired": required,
+        "MarginCallAmount": amounts,
+        "ConfidenceScore": np.round(probabilities * 100, 2),
+    }
+
+
+def margin_call_records(results):
+    # Column arrays -> JSON-ready rows with plain Python types
+    columns = {name: values.tolist() for name, values in results.items()}
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
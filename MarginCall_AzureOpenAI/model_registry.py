@@ -0,0 +1,169 @@
+# model_registry.py
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+
+# Every training run publishes an immutable version directory:
+#   model_registry/<version>/{artifacts..., manifest.json}
+# and CURRENT names the version serving should use. The manifest ties the
+# model, scaler and encoder that belong together.
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+CURRENT_POINTER = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+ARTIFACT_FILES = {
+    "lightgbm": "margin_call_lightgbm_model.joblib",
+    "lstm": "margin_call_lstm_model.pth",
+    "scaler": "lstm_scaler.joblib",
+    "client_encoder": "client_label_encoder.joblib",
+    "ensemble": "ensemble_combiner.joblib",
+}
+REQUIRED_ARTIFACTS = ["lightgbm", "lstm", "scaler", "client_encoder"]
+# Artifacts fitted on top of others are not carried over once those are retrained
+DEPENDENT_ARTIFACTS = {"ensemble": ["lightgbm", "lstm", "scaler"]}
+
+
+class IncompleteBundleError(ValueError):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def atomic_write_text(path, text):
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# ---- Reads ----
+def current_version(registry_dir=REGISTRY_DIR):
+    pointer = os.path.join(registry_dir, CURRENT_POINTER)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer) as f:
+        return f.read().strip() or None
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(registry_dir)
+        if os.path.exists(os.path.join(registry_dir, name, MANIFEST_FILE))
+    )
+
+
+def latest_version(registry_dir=REGISTRY_DIR):
+    # Version names start with their UTC timestamp, so the last one sorted is the newest
+    versions = list_versions(registry_dir)
+    return versions[-1] if versions else None
+
+
+def check_version(version, registry_dir=REGISTRY_DIR):
+    # Versions come from API requests and the CURRENT file and end up in filesystem paths,
+    # so only names of published version directories are accepted
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"Unknown model version '{version}'")
+
+
+def read_manifest(version, registry_dir=REGISTRY_DIR):
+    check_version(version, registry_dir)
+    with open(os.path.join(registry_dir, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def missing_artifacts(paths):
+    return [name for name in REQUIRED_ARTIFACTS if name not in paths or not os.path.exists(paths[name])]
+
+
+def resolve_artifacts(version=None, registry_dir=REGISTRY_DIR):
+    # Returns (version, {artifact name: path}); falls back to the legacy flat
+    # files in the working directory while nothing has been published yet
+    version = version or current_version(registry_dir)
+    if version is None:
+        return "legacy", {name: filename for name, filename in ARTIFACT_FILES.items()}
+
+    manifest = read_manifest(version, registry_dir)
+    paths = {
+        name: os.path.join(registry_dir, version, entry["file"])
+        for name, entry in manifest["artifacts"].items()
+    }
+    return version, paths
+
+
+# ---- Publishing ----
+def publish_version(artifacts, metadata=None, registry_dir=REGISTRY_DIR, activate=True):
+    # `artifacts` maps artifact name -> freshly built file. Anything not given is
+    # carried over from the current version so the new bundle is complete. Before any
+    # version is active (fresh checkout) the newest, still incomplete, one is the parent.
+    os.makedirs(registry_dir, exist_ok=True)
+    parent_version = current_version(registry_dir) or latest_version(registry_dir)
+    _, parent_paths = resolve_artifacts(parent_version, registry_dir)
+
+    version = datetime.now(timezone.utc).strftime("v%Y%m%d-%H%M%S-%f")
+    staging_dir = tempfile.mkdtemp(dir=registry_dir, prefix=".staging-")
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "parent": parent_version,
+        "metadata": metadata or {},
+        "artifacts": {},
+    }
+
+    for name, filename in ARTIFACT_FILES.items():
+        source = artifacts.get(name)
+        carried_over = source is None
+        if carried_over:
+            if any(dep in artifacts for dep in DEPENDENT_ARTIFACTS.get(name, [])):
+                print(f"⚠️ Not carrying over '{name}', the models it was fitted on changed")
+                continue
+            source = parent_paths.get(name)
+        if source is None or not os.path.exists(source):
+            continue
+        shutil.copy2(source, os.path.join(staging_dir, filename))
+        manifest["artifacts"][name] = {
+            "file": filename,
+            "sha256": file_sha256(source),
+            "carried_over": carried_over,
+        }
+
+    missing = [name for name in REQUIRED_ARTIFACTS if name not in manifest["artifacts"]]
+
+    # Models carried over from the parent were trained against the parent's encoder
+    if parent_version and "client_encoder" in artifacts:
+        parent_encoder = read_manifest(parent_version, registry_dir)["artifacts"].get("client_encoder", {})
+        new_encoder = manifest["artifacts"].get("client_encoder", {})
+        stale = [n for n, e in manifest["artifacts"].items() if e["carried_over"] and n != "client_encoder"]
+        if stale and parent_encoder.get("sha256") != new_encoder.get("sha256"):
+            print(f"⚠️ Client encoder changed since {parent_version}; carried-over {stale} should be retrained")
+
+    atomic_write_text(os.path.join(staging_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+    os.replace(staging_dir, os.path.join(registry_dir, version))
+
+    print(f"📦 Published model version {version} to '{registry_dir}'")
+    if missing:
+        # Serving only ever points at complete bundles, the next trainer run carries this one forward
+        print(f"⚠️ Version {version} is missing {missing}, not activated until they are published")
+    elif activate:
+        activate_version(version, registry_dir)
+    return version
+
+
+def activate_version(version, registry_dir=REGISTRY_DIR):
+    manifest = read_manifest(version, registry_dir)
+    missing = [name for name in REQUIRED_ARTIFACTS if name not in manifest["artifacts"]]
+    if missing:
+        raise IncompleteBundleError(f"Model version '{version}' is incomplete, missing {missing}")
+    atomic_write_text(os.path.join(registry_dir, CURRENT_POINTER), version)
@@ -0,0 +1,57 @@
+# precompute_forecasts.py
+#
+# Precomputes T+1..T+H forecasts and explanations for every client the encoder knows
+# and writes them to the forecast store, so /forecast serves them without LLM latency.
+# Schedule it daily after data/model refreshes, e.g. cron:
+#   0 5 * * * cd /app/MarginCall_AzureOpenAI && python precompute_forecasts.py --horizon 3
+
+import time
+import argparse
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import forecaster
+from forecast_store import prune_forecasts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute daily margin call forecasts for all clients")
+    parser.add_argument("--horizon", type=int, default=forecaster.DEFAULT_HORIZON, help="Days ahead to forecast")
+    parser.add_argument("--clients", nargs="*", help="Only these clients (default: every client the encoder knows)")
+    parser.add_argument("--workers", type=int, default=4, help="Clients computed concurrently (LLM-bound)")
+    parser.add_argument("--force", action="store_true", help="Recompute even if the stored forecast is current")
+    parser.add_argument("--keep-days", type=int, default=7, help="Delete stored forecasts older than this")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    clients = args.clients or [str(c) for c in forecaster.current_bundle().client_encoder.classes_]
+    print(f"🗓️ Precomputing T+1..T+{args.horizon} forecasts for {len(clients)} clients "
+          f"(model {forecaster.current_bundle().version})")
+
+    started = time.perf_counter()
+    failures = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(forecaster.stored_forecast, client, args.horizon, args.force, "precompute"): client
+            for client in clients
+        }
+        for future in as_completed(futures):
+            client = futures[future]
+            try:
+                future.result()
+                print(f"✅ {client}")
+            except Exception as e:
+                failures.append(client)
+                print(f"❌ {client}: {e}")
+
+    cutoff = (forecaster.as_of_date() - timedelta(days=args.keep_days)).strftime('%Y-%m-%d')
+    pruned = prune_forecasts(cutoff)
+    print(f"🏁 {len(clients) - len(failures)}/{len(clients)} clients in {time.perf_counter() - started:.1f}s, "
+          f"pruned {pruned} forecasts older than {cutoff}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# prompt_builder.py
+
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+# Whole-prompt budget (instructions + question + context table) in tokens
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1200))
+PROMPT_TOKEN_ENCODING = os.getenv("PROMPT_TOKEN_ENCODING", "cl100k_base")
+# Columns that only matter to the ingest pipeline, not to the explanation
+CONTEXT_DROP_COLUMNS = {"Source"}
+
+INSTRUCTIONS = (
+    "Use the historical margin call records below to answer the question. "
+    "Each row is one client-day. "
+    "If the records do not support an answer, say so."
+)
+
+
+# ---- Token counting: tiktoken when its encoding is available, else ~4 chars per token ----
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(PROMPT_TOKEN_ENCODING)
+                except Exception as e:
+                    print(f"⚠️ tiktoken encoding '{PROMPT_TOKEN_ENCODING}' unavailable, estimating tokens from length: {e}")
+                    _encoding = False
+    return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+# ---- Context compression ----
+def parse_record(text):
+    # rag_index documents are "Column: value" lines
+    record = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(":")
+        if sep and key.strip() not in CONTEXT_DROP_COLUMNS:
+            record[key.strip()] = value.strip()
+    return record
+
+def compact_value(value):
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    if abs(number) >= 1000:
+        return str(int(round(number)))
+    return f"{number:.2f}".rstrip("0").rstrip(".")
+
+def compress_documents(docs):
+    # Retrieved rows -> (columns, unique compacted rows) in retrieval order
+    columns, rows, seen = [], [], set()
+    for doc in docs:
+        record = parse_record(doc.page_content)
+        for column in record:
+            if column not in columns:
+                columns.append(column)
+        compacted = {column: compact_value(value) for column, value in record.items()}
+        key = tuple(sorted(compacted.items()))
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append(compacted)
+    return columns, rows
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    tokens: int
+    rows_retrieved: int
+    rows_used: int
+    duplicates: int
+
+
+def build_prompt(question, docs, token_budget=PROMPT_TOKEN_BUDGET):
+    # Rows are added in relevance order until the budget is spent; the question is always kept
+    question = re.sub(r"\n{3,}", "\n\n", question.strip())
+    columns, rows = compress_documents(docs)
+    duplicates = len(docs) - len(rows)
+
+    header = f"{INSTRUCTIONS}\n\nRecords:\n"
+    footer = f"\n\nQuestion: {question}\nAnswer:"
+    table_header = "|".join(columns)
+    used_tokens = count_tokens(header + footer) + count_tokens(table_header + "\n")
+
+    lines = []
+    for row in rows:
+        line = "|".join(row.get(column, "") for column in columns)
+        line_tokens = count_tokens(line + "\n")
+        if used_tokens + line_tokens > token_budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+
+    table = "\n".join([table_header] + lines) if lines else "(no records)"
+    text = header + table + footer
+    return BuiltPrompt(
+        text=text,
+        tokens=count_tokens(text),
+        rows_retrieved=len(docs),
+        rows_used=len(lines),
+        duplicates=duplicates,
+    )
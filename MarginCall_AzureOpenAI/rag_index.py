@@ -1,42 +1,49 @@
 #rag_index.py
 import os
-import pandas as pd
 from dotenv import load_dotenv
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.docstore.document import Document
 from langchain_community.vectorstores import FAISS
-from langchain_openai.embeddings import AzureOpenAIEmbeddings
+from llm_clients import get_embedding_model
+from feature_store import ensure_store, load_features
+from retrieval import BM25Index, document_text, save_corpus
 
 # Load environment variables
 load_dotenv()
 
-def load_data(csv_path):
-    df = pd.read_csv(csv_path)
-    print(f"📊 Loaded {len(df)} rows from {csv_path}")
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_index")
+
+def load_data():
+    ensure_store()
+    df = load_features()
+    # Documents keep the human-readable CSV representation
+    df["Date"] = df["Date"].dt.strftime("%d-%b-%Y")
+    df["MarginCallMade"] = df["MarginCallMade"].map({1: "Yes", 0: "No"})
+    print(f"📊 Loaded {len(df)} rows from the feature store")
     return df
 
 def prepare_documents(df):
     docs = []
     for _, row in df.iterrows():
-        text = "\n".join([f"{col}: {val}" for col, val in row.items()])
-        docs.append(Document(page_content=text))
+        docs.append(Document(page_content=document_text(row)))
     print(f"📄 Split into {len(docs)} chunks for embedding")
     return docs
 
 def build_vectorstore():
-    df = load_data("MarginCallData.csv")
+    df = load_data()
     docs = prepare_documents(df)
 
-    embedding_model = AzureOpenAIEmbeddings(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION"),
-        deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
-    )
+    embedding_model = get_embedding_model()
 
     vectorstore = FAISS.from_documents(docs, embedding_model)
-    vectorstore.save_local("faiss_index")
-    print("✅ FAISS index saved to 'faiss_index' folder.")
+    vectorstore.save_local(FAISS_INDEX_DIR)
+    print(f"✅ FAISS index saved to '{FAISS_INDEX_DIR}' folder.")
+
+    # Keyword index over the same documents, so retrieval can skip query embeddings
+    texts = [doc.page_content for doc in docs]
+    save_corpus(texts, FAISS_INDEX_DIR)
+    BM25Index(texts).save(FAISS_INDEX_DIR)
+    print(f"✅ BM25 index saved to '{FAISS_INDEX_DIR}' folder.")
 
 if __name__ == "__main__":
     print(f"📁 Current working directory: {os.getcwd()}")
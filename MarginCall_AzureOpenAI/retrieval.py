@@ -0,0 +1,165 @@
+# retrieval.py
+
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import joblib
+from scipy import sparse
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from telemetry import QUERY_EMBEDDING_CACHE
+
+RETRIEVAL_MODES = ("dense", "sparse", "hybrid")
+BM25_INDEX_FILE = "bm25.joblib"
+# Document texts, saved next to the FAISS and BM25 indexes so either can be rebuilt from them
+CORPUS_FILE = "corpus.jsonl"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+# Reciprocal rank fusion constant, the usual default from the RRF paper
+RRF_K = 60
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+def tokenize(text):
+    # "ClientA", "01-Jan-2024", "8453464.0" -> clienta, 01, jan, 2024, 8453464
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    return [token[:-2] if token.endswith(".0") else token for token in tokens]
+
+
+# ---- Document and query text (BM25 only matches what both spell the same way) ----
+def document_value(value):
+    # The feature store keeps numbers as float32: print the shortest text that round-trips
+    # in float32, "5.1" rather than the float64 widening "5.099999904632568"
+    if isinstance(value, (float, np.floating)):
+        return np.format_float_positional(np.float32(value), trim="-")
+    return str(value)
+
+
+def document_text(record):
+    # Columns a source does not carry (e.g. FXRate) are left out rather than written as nan
+    return "\n".join(f"{col}: {document_value(val)}" for col, val in record.items() if pd.notna(val))
+
+
+def explanation_retrieval_query(client_name, input_data, margin_call_required):
+    # Retrieval only needs what distinguishes similar history; the templated prompt's
+    # boilerplate would be shared by every query and drown these terms in BM25
+    return (
+        f"Client: {client_name} MarginCallMade: {'Yes' if margin_call_required else 'No'} "
+        f"Volatility: {float(input_data['Volatility']):.0f} InterestRate: {float(input_data['InterestRate']):g}"
+    )
+
+
+# ---- Sparse index (BM25 over the same documents as FAISS) ----
+class BM25Index:
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.texts = list(texts)
+        self.vocabulary = {}
+        rows, cols, counts = [], [], []
+        doc_lengths = np.zeros(len(self.texts))
+        for doc_id, text in enumerate(self.texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            term_ids, term_counts = np.unique(
+                [self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokens], return_counts=True
+            )
+            rows.extend([doc_id] * len(term_ids))
+            cols.extend(term_ids)
+            counts.extend(term_counts)
+
+        tf = sparse.csc_matrix((counts, (rows, cols)), shape=(len(self.texts), len(self.vocabulary)), dtype=np.float64)
+        df = np.diff(tf.indptr)
+        idf = np.log(1 + (len(self.texts) - df + 0.5) / (df + 0.5))
+
+        # Precompute the full BM25 weight per (doc, term); a query is then a column sum
+        norm = k1 * (1 - b + b * doc_lengths / max(doc_lengths.mean(), 1))
+        weights = tf.tocoo()
+        data = idf[weights.col] * weights.data * (k1 + 1) / (weights.data + norm[weights.row])
+        self.weights = sparse.csc_matrix((data, (weights.row, weights.col)), shape=tf.shape)
+
+    def scores(self, query):
+        term_ids = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not term_ids:
+            return np.zeros(len(self.texts))
+        return np.asarray(self.weights[:, term_ids].sum(axis=1)).ravel()
+
+    def search(self, query, k):
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k else []
+        top = sorted((i for i in top if scores[i] > 0), key=lambda i: -scores[i])
+        return [Document(page_content=self.texts[i]) for i in top]
+
+    def save(self, index_dir):
+        joblib.dump(self, os.path.join(index_dir, BM25_INDEX_FILE))
+
+    @staticmethod
+    def load(index_dir):
+        return joblib.load(os.path.join(index_dir, BM25_INDEX_FILE))
+
+
+def save_corpus(texts, index_dir):
+    with open(os.path.join(index_dir, CORPUS_FILE), "w") as f:
+        for text in texts:
+            f.write(json.dumps({"page_content": text}) + "\n")
+
+
+def load_corpus(index_dir):
+    with open(os.path.join(index_dir, CORPUS_FILE)) as f:
+        return [json.loads(line)["page_content"] for line in f if line.strip()]
+
+
+# ---- Query embedding cache (documents are embedded once at index build time) ----
+class CachedQueryEmbeddings(Embeddings):
+    def __init__(self, base, max_size=QUERY_EMBEDDING_CACHE_SIZE):
+        self.base = base
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                QUERY_EMBEDDING_CACHE.labels(result="hit").inc()
+                return vector
+        QUERY_EMBEDDING_CACHE.labels(result="miss").inc()
+        vector = self.base.embed_query(text)
+        with self._lock:
+            self._cache[text] = vector
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vector
+
+
+# ---- Retriever ----
+class HybridRetriever:
+    # Only dense and hybrid modes embed the query; sparse stays fully local
+    def __init__(self, vectorstore, bm25, mode="hybrid", k=10):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.mode = mode
+        self.k = k
+
+    def invoke(self, query):
+        if self.mode == "sparse":
+            return self.bm25.search(query, self.k)
+        if self.mode == "dense":
+            return self.vectorstore.similarity_search(query, k=self.k)
+
+        # Reciprocal rank fusion over a deeper candidate list from each side
+        fused = {}
+        for results in (self.bm25.search(query, self.k * 2), self.vectorstore.similarity_search(query, k=self.k * 2)):
+            for rank, doc in enumerate(results):
+                score, _ = fused.get(doc.page_content, (0.0, doc))
+                fused[doc.page_content] = (score + 1 / (RRF_K + rank + 1), doc)
+        ranked = sorted(fused.values(), key=lambda item: -item[0])
+        return [doc for _, doc in ranked[:self.k]]
@@ -0,0 +1,70 @@
+# serialization.py
+
+import json
+import numpy as np
+import orjson
+import msgpack
+import pyarrow as pa
+from fastapi.responses import JSONResponse, Response
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+# Accept header value -> response format for bulk endpoints
+RESPONSE_FORMATS = {
+    ARROW_STREAM: "arrow",
+    MSGPACK: "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/json": "json",
+    "*/*": "json",
+}
+
+
+class ORJSONResponse(JSONResponse):
+    # orjson is several times faster than the stdlib encoder and serializes numpy arrays directly
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def negotiate_format(accept_header):
+    # Highest-q supported media type wins, ties go to the client's order; JSON if nothing matches
+    candidates = []
+    for position, part in enumerate((accept_header or "").split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in RESPONSE_FORMATS and quality > 0:
+            candidates.append((-quality, position, RESPONSE_FORMATS[media_type.lower()]))
+    return min(candidates)[2] if candidates else "json"
+
+
+def _arrow_column(values):
+    array = pa.array(np.asarray(values))
+    # Repeated labels such as client names are sent once per distinct value
+    return array.dictionary_encode() if pa.types.is_string(array.type) else array
+
+
+def columnar_response(accept_header, columns, metadata=None):
+    # columns: name -> 1-D array, all the same length, returned as-is in every format
+    metadata = metadata or {}
+    response_format = negotiate_format(accept_header)
+
+    if response_format == "arrow":
+        table = pa.table(
+            {name: _arrow_column(values) for name, values in columns.items()},
+        ).replace_schema_metadata({key: json.dumps(value) for key, value in metadata.items()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(content=sink.getvalue().to_pybytes(), media_type=ARROW_STREAM)
+
+    if response_format == "msgpack":
+        payload = {**metadata, "columns": {name: np.asarray(values).tolist() for name, values in columns.items()}}
+        return Response(content=msgpack.packb({"response": payload}), media_type=MSGPACK)
+
+    return ORJSONResponse({"response": {**metadata, **columns}})
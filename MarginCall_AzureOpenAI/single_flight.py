@@ -0,0 +1,54 @@
+# single_flight.py
+
+import threading
+from telemetry import COALESCED_REQUESTS, INFLIGHT_COMPUTATIONS
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution: the first caller runs it,
+    # the rest block until it finishes and get the same result (or the same exception)
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            COALESCED_REQUESTS.labels(operation=self.name, role="follower").inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        COALESCED_REQUESTS.labels(operation=self.name, role="leader").inc()
+        INFLIGHT_COMPUTATIONS.labels(operation=self.name).inc()
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # Later requests start fresh (and usually hit the forecast store instead)
+            with self._lock:
+                del self._calls[key]
+            INFLIGHT_COMPUTATIONS.labels(operation=self.name).dec()
+            if call.waiters:
+                print(f"🔗 {self.name} {key}: {call.waiters} request(s) shared one computation")
+            call.done.set()
+        return call.result
@@ -0,0 +1,129 @@
+# telemetry.py
+
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Latencies run from sub-millisecond model calls up to multi-second LLM answers
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# USD per 1K tokens, set to the deployment's price to get cost totals
+LLM_PROMPT_COST_PER_1K = float(os.getenv("LLM_PROMPT_COST_PER_1K_TOKENS", 0))
+LLM_COMPLETION_COST_PER_1K = float(os.getenv("LLM_COMPLETION_COST_PER_1K_TOKENS", 0))
+
+REQUEST_LATENCY = Histogram(
+    "margincall_request_latency_seconds", "API request latency", ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "margincall_stage_latency_seconds", "Latency of forecaster stages", ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALLS = Counter("margincall_llm_calls_total", "LLM completions", ["model"])
+LLM_TOKENS = Counter("margincall_llm_tokens_total", "LLM tokens used", ["model", "kind"])
+LLM_COST = Counter("margincall_llm_cost_usd_total", "Estimated LLM cost in USD", ["model"])
+QUERY_EMBEDDING_CACHE = Counter("margincall_query_embedding_cache_total", "Query embedding cache lookups", ["result"])
+# role=leader ran the computation, role=follower waited for a leader's result
+COALESCED_REQUESTS = Counter(
+    "margincall_coalesced_requests_total", "Requests by single-flight role", ["operation", "role"]
+)
+INFLIGHT_COMPUTATIONS = Gauge("margincall_inflight_computations", "Single-flight computations running", ["operation"])
+FORECAST_STORE_LOOKUPS = Counter("margincall_forecast_store_lookups_total", "Precomputed forecast lookups", ["result"])
+PROMPT_CONTEXT_ROWS = Counter(
+    "margincall_prompt_context_rows_total", "Retrieved rows by what the prompt builder did with them", ["outcome"]
+)
+
+
+# ---- Optional OpenTelemetry tracing (exports to a local OTLP collector when configured) ----
+_tracer = None
+
+def setup_tracing(endpoint=None, service_name="margin-call-api"):
+    global _tracer
+    endpoint = endpoint or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if not endpoint or _tracer is not None:
+        return _tracer
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        print("⚠️ OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk/exporter are not installed, tracing disabled")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces")))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("margincall")
+    print(f"📡 Exporting traces to {endpoint}")
+    return _tracer
+
+
+@contextmanager
+def _maybe_span(name):
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name):
+        yield
+
+
+# ---- Timing spans ----
+@contextmanager
+def stage_span(stage):
+    started = time.perf_counter()
+    try:
+        with _maybe_span(stage):
+            yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def request_span(endpoint, method):
+    # Yields a dict; set "endpoint" (route template) and "status" before leaving
+    # so the histogram and the trace span carry them
+    result = {"endpoint": endpoint, "status": 500}
+    started = time.perf_counter()
+    try:
+        if _tracer is None:
+            yield result
+        else:
+            with _tracer.start_as_current_span(f"{method} {endpoint}") as span:
+                yield result
+                span.update_name(f"{method} {result['endpoint']}")
+                span.set_attributes({
+                    "http.method": method,
+                    "http.route": result["endpoint"],
+                    "http.status_code": result["status"],
+                })
+    finally:
+        REQUEST_LATENCY.labels(endpoint=result["endpoint"], method=method, status=str(result["status"])).observe(
+            time.perf_counter() - started
+        )
+
+
+# ---- LLM token and cost counters ----
+class LLMUsageCallback(BaseCallbackHandler):
+    def on_llm_end(self, response, **kwargs):
+        llm_output = response.llm_output or {}
+        usage = llm_output.get("token_usage") or {}
+        model = llm_output.get("model_name") or os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "unknown")
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+
+        LLM_CALLS.labels(model=model).inc()
+        LLM_TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
+        LLM_COST.labels(model=model).inc(
+            prompt_tokens / 1000 * LLM_PROMPT_COST_PER_1K + completion_tokens / 1000 * LLM_COMPLETION_COST_PER_1K
+        )
+
+llm_usage_callback = LLMUsageCallback()
+
+
+def metrics_payload():
+    return generate_latest(), CONTENT_TYPE_LATEST
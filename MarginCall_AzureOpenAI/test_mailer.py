@@ -0,0 +1,75 @@
+# test_mailer.py
+
+import socket
+import pytest
+from mailer import MailDispatcher, OutgoingMail
+
+Controller = pytest.importorskip("aiosmtpd.controller").Controller
+
+REFUSED = "refused@example.com"
+
+
+class RecordingHandler:
+    # Local SMTP stand-in: remembers which connection (client address) delivered each message
+    def __init__(self):
+        self.deliveries = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.deliveries.append((session.peer, envelope.rcpt_tos[0]))
+        return "250 Message accepted"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield handler, controller.port
+    controller.stop()
+
+
+def make_dispatcher(port, **kwargs):
+    return MailDispatcher("127.0.0.1", port, "agent@example.com", use_ssl=False, max_connections=1, **kwargs)
+
+
+def mails_to(*receivers):
+    return [OutgoingMail(receiver, "Forecast", "<p>report</p>") for receiver in receivers]
+
+
+def test_messages_reuse_one_connection(smtp_server):
+    handler, port = smtp_server
+    results = make_dispatcher(port).send(mails_to("a@example.com", "b@example.com", "c@example.com"))
+
+    assert [error for _, error in results] == [None, None, None]
+    assert [receiver for _, receiver in handler.deliveries] == ["a@example.com", "b@example.com", "c@example.com"]
+    assert len({session for session, _ in handler.deliveries}) == 1
+
+
+def test_connection_recycled_after_messages_per_connection(smtp_server):
+    handler, port = smtp_server
+    make_dispatcher(port, messages_per_connection=2).send(mails_to(*[f"{i}@example.com" for i in range(5)]))
+
+    sessions = [session for session, _ in handler.deliveries]
+    assert len(sessions) == 5
+    assert sessions[0] == sessions[1] != sessions[2] == sessions[3] != sessions[4]
+
+
+def test_refused_recipient_keeps_the_connection(smtp_server):
+    handler, port = smtp_server
+    results = make_dispatcher(port).send(mails_to("a@example.com", REFUSED, "c@example.com"))
+
+    assert [error is None for _, error in results] == [True, False, True]
+    assert [receiver for _, receiver in handler.deliveries] == ["a@example.com", "c@example.com"]
+    assert len({session for session, _ in handler.deliveries}) == 1
@@ -0,0 +1,24 @@
+# test_margin_engine.py
+
+from margin_engine import margin_calls, margin_call_records
+
+
+def test_call_below_mta_is_not_required():
+    # Exposure 50,000 over collateral + threshold, MTA 100,000: the model expects a call, the CSA does not
+    results = margin_calls([0.9], mtm=[1_150_000], collateral=[1_000_000], threshold=[100_000], mta=[100_000])
+    assert margin_call_records(results) == [
+        {"MarginCallRequired": False, "MarginCallAmount": 0.0, "ConfidenceScore": 90.0}
+    ]
+
+
+def test_call_at_or_above_mta_keeps_its_amount():
+    results = margin_calls(
+        [0.9, 0.9, 0.1],
+        mtm=[1_200_000, 1_350_000.123, 1_350_000],
+        collateral=[1_000_000] * 3,
+        threshold=[100_000] * 3,
+        mta=[100_000] * 3,
+    )
+    assert results["MarginCallRequired"].tolist() == [True, True, False]
+    assert results["MarginCallAmount"].tolist() == [100_000.0, 250_000.12, 0.0]
+
@@ -0,0 +1,32 @@
+# test_retrieval.py
+
+import numpy as np
+import pandas as pd
+from retrieval import document_text, explanation_retrieval_query, tokenize
+
+
+def store_row(**values):
+    # One row as rag_index.load_data hands it over: float32 numbers, readable Date and MarginCallMade
+    row = {
+        "Date": "20-Sep-2024", "Client": "ClientA", "MTM": 7610073.0, "Collateral": 5596552.0,
+        "Threshold": 1883754.0, "Volatility": 27.0, "Currency": "USD", "InterestRate": 5.1,
+        "FXRate": np.nan, "MTA": 100000.0, "MarginCallMade": "Yes", "MarginCallAmount": 129767.0,
+    }
+    row.update(values)
+    df = pd.DataFrame([row]).astype({col: "float32" for col in row if isinstance(row[col], float)})
+    return next(df.iterrows())[1]
+
+
+def test_float32_values_are_written_as_stored():
+    text = document_text(store_row())
+    assert "InterestRate: 5.1\n" in text
+    assert "MTM: 7610073\n" in text
+    assert "FXRate" not in text
+
+
+def test_query_terms_all_appear_in_the_document_they_describe():
+    for interest_rate in (4.6, 4.8, 5.0, 5.1, 5.5):
+        for made in ("Yes", "No"):
+            row = store_row(InterestRate=interest_rate, MarginCallMade=made, Volatility=31.0)
+            query = explanation_retrieval_query(row["Client"], row, made == "Yes")
+            assert set(tokenize(query)) <= set(tokenize(document_text(row))), query
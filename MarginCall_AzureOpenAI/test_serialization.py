@@ -0,0 +1,74 @@
+# test_serialization.py
+
+import os
+import json
+import msgpack
+import pyarrow as pa
+import pytest
+from serialization import ARROW_STREAM, MSGPACK, negotiate_format
+
+BATCH = {
+    "Client": ["ClientA", "ClientB", "ClientA"],
+    "MTM": [8453464.0, 3694397.0, 1200000.0],
+    "Collateral": [7388691.0, 3065326.0, 1000000.0],
+    "Threshold": [1010719.0, 427629.0, 100000.0],
+    "Volatility": [29.0, 20.0, 35.0],
+    "InterestRate": [5.1, 4.8, 5.5],
+    "MTA": [100000.0, 200000.0, 100000.0],
+}
+
+
+def test_q_zero_excludes_a_media_type():
+    assert negotiate_format(f"{ARROW_STREAM};q=0, {MSGPACK};q=0.5") == "msgpack"
+    assert negotiate_format(f"{MSGPACK};q=0") == "json"
+
+
+def test_ties_go_to_header_order():
+    assert negotiate_format(f"{MSGPACK}, {ARROW_STREAM}") == "msgpack"
+    assert negotiate_format(f"{ARROW_STREAM};q=0.8, {MSGPACK};q=0.8") == "arrow"
+    assert negotiate_format(f"{ARROW_STREAM};q=0.5, {MSGPACK};q=0.8") == "msgpack"
+
+
+def test_wildcard_and_unknown_fall_back_to_json():
+    assert negotiate_format("*/*") == "json"
+    assert negotiate_format("text/html, */*;q=0.1") == "json"
+    assert negotiate_format("text/html") == "json"
+    assert negotiate_format(None) == "json"
+
+
+@pytest.fixture(scope="module")
+def client():
+    # The API loads the feature store and the current model bundle at import; no LLM call is made
+    os.environ.setdefault("LLM_REPLAY_MODE", "replay")
+    from fastapi.testclient import TestClient
+    try:
+        import main
+    except (FileNotFoundError, ValueError) as e:
+        pytest.skip(f"API needs a feature store and a trained model bundle: {e}")
+    return TestClient(main.app)
+
+
+def post_batch(client, accept):
+    response = client.post("/what-if/batch", json=BATCH, headers={"Accept": accept})
+    assert response.status_code == 200, response.text
+    return response
+
+
+@pytest.mark.parametrize("accept", [MSGPACK, ARROW_STREAM])
+def test_what_if_batch_round_trips(client, accept):
+    expected = post_batch(client, "application/json").json()["response"]
+
+    response = post_batch(client, accept)
+    assert response.headers["content-type"] == accept
+    if accept == MSGPACK:
+        payload = msgpack.unpackb(response.content)["response"]
+        version, columns = payload["ModelVersion"], payload["columns"]
+    else:
+        table = pa.ipc.open_stream(response.content).read_all()
+        version = json.loads(table.schema.metadata[b"ModelVersion"])
+        columns = table.to_pydict()
+
+    assert version == expected["ModelVersion"]
+    assert columns["Client"] == BATCH["Client"]
+    for name in ("MarginCallRequired", "MarginCallAmount", "ConfidenceScore"):
+        assert columns[name] == pytest.approx(expected[name]), name
@@ -0,0 +1,67 @@
+# test_single_flight.py
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from single_flight import SingleFlight
+
+CALLERS = 8
+
+
+def run_concurrently(flight, key, fn):
+    # The leader's fn blocks until every other caller is waiting on it, so all of them share one call
+    release = threading.Event()
+
+    def blocking_fn():
+        release.wait(timeout=5)
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        futures = [pool.submit(flight.do, key, blocking_fn) for _ in range(CALLERS)]
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            call = flight._calls.get(key)
+            if call is not None and call.waiters == CALLERS - 1:
+                break
+            time.sleep(0.001)
+        release.set()
+        return futures
+
+
+def test_concurrent_callers_share_one_execution():
+    flight, executions = SingleFlight("test"), []
+
+    def compute():
+        executions.append(1)
+        return {"forecast": 42}
+
+    futures = run_concurrently(flight, "ClientA", compute)
+    results = [future.result() for future in futures]
+    assert len(executions) == 1
+    assert all(result is results[0] for result in results)
+    assert flight._calls == {}
+
+
+def test_followers_get_the_leaders_exception():
+    flight, executions = SingleFlight("test"), []
+
+    def compute():
+        executions.append(1)
+        raise RuntimeError("LLM unavailable")
+
+    futures = run_concurrently(flight, "ClientA", compute)
+    for future in futures:
+        with pytest.raises(RuntimeError, match="LLM unavailable"):
+            future.result()
+    assert len(executions) == 1
+    assert flight._calls == {}
+
+
+def test_key_is_released_for_later_calls():
+    flight = SingleFlight("test")
+    with pytest.raises(ValueError):
+        flight.do("ClientA", lambda: int("not a number"))
+    assert flight.do("ClientA", lambda: 1) == 1
+    assert flight.do("ClientA", lambda: 2) == 2
+    assert flight._calls == {}
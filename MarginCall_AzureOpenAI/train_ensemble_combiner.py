@@ -0,0 +1,71 @@
+# train_ensemble_combiner.py
+
+import os
+import argparse
+import tempfile
+import joblib
+import forecaster
+from ensemble import ENSEMBLE_MODES, DEFAULT_CASCADE_BAND, EnsembleCombiner, ensemble_stats, fit_combiner, evaluate_combiner
+from feature_store import NUMERIC_FEATURES, TARGET, HOLDOUT_FRACTION, ensure_store, load_features, time_based_split
+from model_registry import ARTIFACT_FILES, publish_version
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fit the ensemble combiner on held-out data and publish it")
+    parser.add_argument("--mode", choices=ENSEMBLE_MODES, default="stacking", help="Mode stored with the fitted combiner")
+    parser.add_argument("--holdout-fraction", type=float, default=HOLDOUT_FRACTION,
+                        help="Share of the most recent dates the base models were not trained on")
+    parser.add_argument("--eval-fraction", type=float, default=0.5,
+                        help="Share of the held-out dates (the most recent) kept for evaluation only")
+    parser.add_argument("--band", type=float, nargs=2, default=DEFAULT_CASCADE_BAND, help="Cascade uncertainty band")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    bundle = forecaster.current_bundle()
+
+    # Held-out dates: both trainers use the same time split, so neither base model was
+    # fitted on them (the LSTM only picks its best epoch there). The earlier part fits
+    # the combiner, the later part is only used to report how well it does
+    ensure_store()
+    df = load_features(columns=["Date", "Client"] + NUMERIC_FEATURES + [TARGET])
+    train_mask, cutoff = time_based_split(df, args.holdout_fraction)
+    holdout = df[~train_mask].reset_index(drop=True)
+    fit_mask, eval_cutoff = time_based_split(holdout, args.eval_fraction)
+
+    X = forecaster.build_feature_matrix(holdout, bundle)
+    y = holdout[TARGET].to_numpy()
+    p_lgbm = forecaster.predict_lightgbm_matrix(X, bundle)
+    p_lstm = forecaster.predict_lstm_matrix(X, bundle)
+
+    fit, evaluate = fit_mask, ~fit_mask
+    combiner = fit_combiner(p_lgbm[fit], p_lstm[fit], y[fit], mode=args.mode, cascade_band=tuple(args.band))
+
+    print(f"Fit rows: {int(fit.sum())} from {str(cutoff)[:10]}, evaluation rows: {int(evaluate.sum())} "
+          f"from {str(eval_cutoff)[:10]}, learned weights: {combiner.weights}")
+    print(f"Fixed 50/50: {evaluate_combiner(EnsembleCombiner('average'), p_lgbm[evaluate], p_lstm[evaluate], y[evaluate])}")
+    for mode in ("weighted", "stacking"):
+        print(f"{mode}: {evaluate_combiner(combiner.with_mode(mode), p_lgbm[evaluate], p_lstm[evaluate], y[evaluate])}")
+
+    cascade = combiner.with_mode("cascade")
+    before = ensemble_stats.snapshot()
+    cascade.predict(X[evaluate], lambda m: forecaster.predict_lightgbm_matrix(m, bundle), lambda m: forecaster.predict_lstm_matrix(m, bundle))
+    after = ensemble_stats.snapshot()
+    skipped = (after["second_model_skipped_rows"] - before["second_model_skipped_rows"]) / int(evaluate.sum())
+    print(f"cascade band {cascade.cascade_band}: LSTM skipped for {skipped:.1%} of evaluation rows")
+
+    with tempfile.TemporaryDirectory() as staging_dir:
+        path = os.path.join(staging_dir, ARTIFACT_FILES["ensemble"])
+        joblib.dump(combiner, path)
+        publish_version(
+            {"ensemble": path},
+            metadata={"trainer": "ensemble", "mode": args.mode, "weights": combiner.weights,
+                      "holdout_from": str(cutoff)[:10], "evaluation_from": str(eval_cutoff)[:10]},
+        )
+
+    print("✅ Ensemble combiner saved!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,79 +1,286 @@
 # train_margin_call_lightgbm.py
 
-import pandas as pd
+import os
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import lightgbm as lgb
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, roc_auc_score
-from sklearn.preprocessing import LabelEncoder
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import accuracy_score, roc_auc_score, log_loss
 import joblib
-
-# 1. Load the data
-df = pd.read_csv("MarginCallData.csv")
-
-# 2. Label Encode 'Client'
-client_encoder = LabelEncoder()
-df["Client_Encoded"] = client_encoder.fit_transform(df["Client"])
-
-# 3. Convert 'MarginCallMade' to numeric
-df["MarginCallMade"] = df["MarginCallMade"].map({"Yes": 1, "No": 0})
-
-# 4. Define features and target (with Client_Encoded)
-features = ["Client_Encoded", "MTM", "Collateral", "Threshold", "Volatility", "InterestRate", "MTA"]
-target = "MarginCallMade"
-
-X = df[features]
-y = df[target]
-
-# 5. Train-test split
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42, stratify=y
+from feature_store import (
+    NUMERIC_FEATURES, TARGET, CLIENT_ENCODER_PATH, HOLDOUT_FRACTION,
+    ensure_store, load_features, load_client_encoder, feature_matrix, time_based_split
 )
+from model_registry import ARTIFACT_FILES, publish_version
 
-# 6. LightGBM datasets
-train_data = lgb.Dataset(X_train, label=y_train)
-valid_data = lgb.Dataset(X_test, label=y_test, reference=train_data)
+MODEL_PATH = ARTIFACT_FILES["lightgbm"]
+RESULTS_DB = "lightgbm_hpo_results.sqlite"
 
-# 7. Define parameters
-params = {
+BASE_PARAMS = {
     "objective": "binary",
     "boosting_type": "gbdt",
     "metric": "binary_logloss",
     "verbosity": -1,
-    "learning_rate": 0.05,
-    "num_leaves": 31,
     "max_depth": -1,
-    "random_state": 42,
-    "n_jobs": -1
 }
 
-# 8. Train the model
-print("Training LightGBM Model...")
-
-model = lgb.train(
-    params,
-    train_data,
-    valid_sets=[train_data, valid_data],
-    valid_names=["train", "valid"],
-    num_boost_round=1000,
-    callbacks=[
-        lgb.early_stopping(stopping_rounds=50),
-        lgb.log_evaluation(period=100)
-    ]
-)
+# The original fixed parameter set, always evaluated as trial 0 so search never does worse
+DEFAULT_PARAMS = {"num_leaves": 31, "learning_rate": 0.05, "min_data_in_leaf": 20, "feature_fraction": 1.0}
+
+# name: (low, high, scale)
+SEARCH_SPACE = {
+    "num_leaves": (8, 128, "int_log"),
+    "learning_rate": (0.01, 0.3, "log"),
+    "min_data_in_leaf": (5, 100, "int"),
+    "feature_fraction": (0.5, 1.0, "uniform"),
+}
+
+NUM_BOOST_ROUND = 1000
+EARLY_STOPPING_ROUNDS = 50
+# A trial is pruned once its running CV loss is this much worse than the best finished trial
+PRUNE_MARGIN = 0.10
+
+
+# ---- Search Space Sampling ----
+def sample_random_params(rng):
+    params = {}
+    for name, (low, high, scale) in SEARCH_SPACE.items():
+        if scale == "int_log":
+            params[name] = int(round(np.exp(rng.uniform(np.log(low), np.log(high)))))
+        elif scale == "log":
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        elif scale == "int":
+            params[name] = int(rng.integers(low, high + 1))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    return params
+
+
+def suggest_optuna_params(trial):
+    params = {}
+    for name, (low, high, scale) in SEARCH_SPACE.items():
+        if scale in ("int", "int_log"):
+            params[name] = trial.suggest_int(name, low, high, log=scale == "int_log")
+        else:
+            params[name] = trial.suggest_float(name, low, high, log=scale == "log")
+    return params
+
+
+# ---- Results Store ----
+def open_results_store(path=RESULTS_DB):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS trials (
+            run_id TEXT,
+            trial_id INTEGER,
+            params TEXT,
+            status TEXT,
+            cv_logloss REAL,
+            cv_auc REAL,
+            best_iteration INTEGER,
+            folds_completed INTEGER,
+            wall_time_s REAL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, trial_id)
+        )
+    """)
+    return conn
+
+
+def record_trial(conn, run_id, result):
+    conn.execute(
+        "INSERT OR REPLACE INTO trials "
+        "(run_id, trial_id, params, status, cv_logloss, cv_auc, best_iteration, folds_completed, wall_time_s) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            run_id, result["trial_id"], json.dumps(result["params"]), result["status"],
+            result["cv_logloss"], result["cv_auc"], result["best_iteration"],
+            result["folds_completed"], result["wall_time_s"],
+        ),
+    )
+    conn.commit()
+
+
+# ---- Cross-Validated Trial (runs in a worker process) ----
+_worker_data = {}
+
+def init_worker(X, y, num_threads):
+    _worker_data["X"] = X
+    _worker_data["y"] = y
+    _worker_data["num_threads"] = num_threads
+
+
+def run_trial(trial_id, params, n_folds, seed, prune_above=None):
+    X, y = _worker_data["X"], _worker_data["y"]
+    started = time.perf_counter()
+    trial_params = {**BASE_PARAMS, **params, "seed": seed, "num_threads": _worker_data["num_threads"]}
+
+    fold_losses, fold_aucs, best_iterations = [], [], []
+    status = "complete"
+    folds = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+    for train_idx, valid_idx in folds.split(X, y):
+        train_data = lgb.Dataset(X[train_idx], label=y[train_idx])
+        valid_data = lgb.Dataset(X[valid_idx], label=y[valid_idx], reference=train_data)
+        model = lgb.train(
+            trial_params,
+            train_data,
+            valid_sets=[valid_data],
+            num_boost_round=NUM_BOOST_ROUND,
+            callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING_ROUNDS, verbose=False)]
+        )
+        y_pred = model.predict(X[valid_idx], num_iteration=model.best_iteration)
+        fold_losses.append(log_loss(y[valid_idx], y_pred))
+        fold_aucs.append(roc_auc_score(y[valid_idx], y_pred))
+        best_iterations.append(model.best_iteration)
+
+        # Prune: stop spending folds on a trial that is already clearly behind
+        if prune_above is not None and np.mean(fold_losses) > prune_above and len(fold_losses) < n_folds:
+            status = "pruned"
+            break
+
+    return {
+        "trial_id": trial_id,
+        "params": params,
+        "status": status,
+        "cv_logloss": float(np.mean(fold_losses)),
+        "cv_auc": float(np.mean(fold_aucs)),
+        "best_iteration": int(np.mean(best_iterations)),
+        "folds_completed": len(fold_losses),
+        "wall_time_s": round(time.perf_counter() - started, 3),
+    }
+
+
+# ---- Search ----
+def search(X, y, n_trials, n_workers, n_folds, seed, sampler, conn, run_id):
+    rng = np.random.default_rng(seed)
+    study = None
+    if sampler == "tpe":
+        import optuna  # optional, only needed for Bayesian search
+        optuna.logging.set_verbosity(optuna.logging.WARNING)
+        study = optuna.create_study(direction="minimize", sampler=optuna.samplers.TPESampler(seed=seed))
+        study.enqueue_trial(DEFAULT_PARAMS)
+
+    def next_params(trial_id):
+        if study is not None:
+            trial = study.ask()
+            return trial, suggest_optuna_params(trial)
+        return None, DEFAULT_PARAMS if trial_id == 0 else sample_random_params(rng)
+
+    num_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    best = None
+    # Deterministic waves of n_workers trials: parameters, prune thresholds and sampler
+    # updates only depend on earlier waves and are applied in trial order, never in the
+    # order trials happen to finish, so a seed gives the same search for a given --workers
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(X, y, num_threads)) as pool:
+        for wave_start in range(0, n_trials, n_workers):
+            prune_above = best["cv_logloss"] * (1 + PRUNE_MARGIN) if best else None
+            wave = [(trial_id, *next_params(trial_id))
+                    for trial_id in range(wave_start, min(wave_start + n_workers, n_trials))]
+            futures = [pool.submit(run_trial, trial_id, params, n_folds, seed, prune_above)
+                       for trial_id, _, params in wave]
+
+            for (_, trial, _), future in zip(wave, futures):
+                result = future.result()
+                record_trial(conn, run_id, result)
+                if study is not None:
+                    if result["status"] == "pruned":
+                        study.tell(trial, state=optuna.trial.TrialState.PRUNED)
+                    else:
+                        study.tell(trial, result["cv_logloss"])
+
+                if result["status"] == "complete" and (best is None or result["cv_logloss"] < best["cv_logloss"]):
+                    best = result
+                print(
+                    f"Trial {result['trial_id']:>3} [{result['status']}] "
+                    f"logloss={result['cv_logloss']:.4f} auc={result['cv_auc']:.4f} "
+                    f"folds={result['folds_completed']} time={result['wall_time_s']:.2f}s params={result['params']}"
+                )
+
+    return best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cross-validated hyperparameter search for the LightGBM margin call model")
+    parser.add_argument("--trials", type=int, default=30, help="Number of parameter sets to evaluate")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel trial processes")
+    parser.add_argument("--folds", type=int, default=5, help="Cross-validation folds per trial")
+    parser.add_argument("--sampler", choices=["random", "tpe"], default="random",
+                        help="random search, or Bayesian TPE search (requires optuna)")
+    parser.add_argument("--holdout-fraction", type=float, default=HOLDOUT_FRACTION, help="Share of the most recent dates held out")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--results-db", default=RESULTS_DB, help="SQLite file the trial results are written to")
+    args = parser.parse_args()
+    if args.trials < 1:
+        parser.error("--trials must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # 1. Load the data (only the columns training needs), ingesting new CSVs first
+    ensure_store()
+    df = load_features(columns=["Date", "Client"] + NUMERIC_FEATURES + [TARGET])
+
+    # 2. Encode 'Client' with the shared encoder and build the feature matrix
+    client_encoder = load_client_encoder()
+    X, y = feature_matrix(df, client_encoder)
+
+    # 3. Hold out the most recent dates, the search only ever sees the earlier part.
+    # Same split as the LSTM trainer, so the ensemble combiner can be fitted on dates
+    # neither model was trained on
+    train_mask, cutoff = time_based_split(df, args.holdout_fraction)
+    X, y = X.to_numpy(), y.to_numpy()
+    X_train, X_test, y_train, y_test = X[train_mask], X[~train_mask], y[train_mask], y[~train_mask]
+    print(f"Train: {len(X_train)} rows before {str(cutoff)[:10]}, Test: {len(X_test)} rows from {str(cutoff)[:10]}")
+
+    # 4. Parallel cross-validated search
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    conn = open_results_store(args.results_db)
+    print(f"Searching {args.trials} trials with {args.workers} workers ({args.sampler}, run {run_id})...")
+    started = time.perf_counter()
+    best = search(X_train, y_train, args.trials, args.workers, args.folds, args.seed, args.sampler, conn, run_id)
+    conn.close()
+    print(f"Search finished in {time.perf_counter() - started:.1f}s")
+    print(f"Best trial {best['trial_id']}: logloss={best['cv_logloss']:.4f} auc={best['cv_auc']:.4f} params={best['params']}")
+
+    # 5. Refit the best parameters on the whole training set
+    final_params = {**BASE_PARAMS, **best["params"], "seed": args.seed, "n_jobs": -1}
+    model = lgb.train(final_params, lgb.Dataset(X_train, label=y_train), num_boost_round=max(best["best_iteration"], 1))
 
-# 9. Make predictions
-y_pred = model.predict(X_test, num_iteration=model.best_iteration)
-y_pred_binary = [1 if pred > 0.5 else 0 for pred in y_pred]
+    # 6. Evaluate on the held-out set
+    y_pred = model.predict(X_test)
+    y_pred_binary = (y_pred > 0.5).astype(int)
+    accuracy = accuracy_score(y_test, y_pred_binary)
+    roc_auc = roc_auc_score(y_test, y_pred)
+    print(f"Accuracy: {accuracy:.4f}")
+    print(f"ROC AUC Score: {roc_auc:.4f}")
 
-# 10. Evaluate
-accuracy = accuracy_score(y_test, y_pred_binary)
-roc_auc = roc_auc_score(y_test, y_pred)
+    # 7. Publish a new registry version with the model and the encoder it was trained with
+    with tempfile.TemporaryDirectory() as staging_dir:
+        model_path = os.path.join(staging_dir, MODEL_PATH)
+        joblib.dump(model, model_path)
+        publish_version(
+            {"lightgbm": model_path, "client_encoder": CLIENT_ENCODER_PATH},
+            metadata={
+                "trainer": "lightgbm",
+                "hpo_run_id": run_id,
+                "params": best["params"],
+                "test_cutoff": str(cutoff)[:10],
+                "accuracy": round(float(accuracy), 4),
+                "roc_auc": round(float(roc_auc), 4),
+            },
+        )
 
-print(f"Accuracy: {accuracy:.4f}")
-print(f"ROC AUC Score: {roc_auc:.4f}")
+    print("✅ LightGBM model saved!")
 
-# 11. Save Model and Client Encoder
-joblib.dump(model, "margin_call_lightgbm_model.joblib")
-joblib.dump(client_encoder, "client_label_encoder.joblib")
 
-print("✅ LightGBM model and client label encoder saved!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,28 @@
 # train_margin_call_lstm.py
 
-import pandas as pd
+import os
+import time
+import argparse
+import tempfile
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, TensorDataset
-from sklearn.preprocessing import MinMaxScaler, LabelEncoder
+from torch.utils.data import DataLoader, TensorDataset, BatchSampler, RandomSampler, SequentialSampler
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.metrics import roc_auc_score
 import joblib
+from feature_store import (
+    FEATURES, NUMERIC_FEATURES, TARGET, CLIENT_ENCODER_PATH, HOLDOUT_FRACTION,
+    ensure_store, load_features, load_client_encoder, feature_matrix, time_based_split
+)
+from model_registry import ARTIFACT_FILES, publish_version
 
-# 1. Load data
-df = pd.read_csv("MarginCallData.csv")
+MODEL_PATH = ARTIFACT_FILES["lstm"]
+SCALER_PATH = ARTIFACT_FILES["scaler"]
+CHECKPOINT_PATH = "lstm_checkpoint.pt"
 
-# 2. Label Encoding for Client
-client_encoder = LabelEncoder()
-df["Client_Encoded"] = client_encoder.fit_transform(df["Client"])
 
-# 3. Features and Target
-features = ["Client_Encoded", "MTM", "Collateral", "Threshold", "Volatility", "InterestRate", "MTA"]
-target = "MarginCallMade"
-
-# 4. Convert MarginCallMade to binary
-df["MarginCallMade"] = df["MarginCallMade"].map({"Yes": 1, "No": 0})
-
-X = df[features]
-y = df[target]
-
-# 5. Normalize features
-scaler = MinMaxScaler()
-X_scaled = scaler.fit_transform(X)
-
-# 6. Prepare for LSTM (batch_size, seq_len, input_size)
-X_scaled = np.expand_dims(X_scaled, axis=1)
-
-# 7. Split into train and test
-split = int(0.8 * len(X))
-X_train, X_test = X_scaled[:split], X_scaled[split:]
-y_train, y_test = y[:split], y[split:]
-
-# 8. Convert to tensors
-X_train_tensor = torch.tensor(X_train, dtype=torch.float32)
-y_train_tensor = torch.tensor(y_train.values, dtype=torch.float32)
-
-X_test_tensor = torch.tensor(X_test, dtype=torch.float32)
-y_test_tensor = torch.tensor(y_test.values, dtype=torch.float32)
-
-train_dataset = TensorDataset(X_train_tensor, y_train_tensor)
-train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-
-# 9. Define LSTM Model
+# ---- LSTM Model (state dict layout matches forecaster.MarginCallLSTM) ----
 class LSTMModel(nn.Module):
     def __init__(self, input_size):
         super(LSTMModel, self).__init__()
@@ -60,30 +35,205 @@ class LSTMModel(nn.Module):
         out = self.fc(lstm_out[:, -1, :])
         return self.sigmoid(out)
 
-model = LSTMModel(input_size=len(features))
-
-# 10. Loss and Optimizer
-criterion = nn.BCELoss()
-optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
-
-# 11. Train the Model
-print("Training LSTM Model...")
-epochs = 50
-for epoch in range(epochs):
-    model.train()
-    for xb, yb in train_loader:
-        optimizer.zero_grad()
-        outputs = model(xb).squeeze()
-        loss = criterion(outputs, yb)
-        loss.backward()
-        optimizer.step()
-
-    if (epoch+1) % 10 == 0:
-        print(f"Epoch {epoch+1}/{epochs}, Loss: {loss.item():.4f}")
-
-# 12. Save Model, Scaler, and LabelEncoder
-torch.save(model.state_dict(), "margin_call_lstm_model.pth")
-joblib.dump(scaler, "lstm_scaler.joblib")
-joblib.dump(client_encoder, "client_label_encoder.joblib")
-
-print("✅ LSTM model, scaler, and client label encoder saved!")
\ No newline at end of file
+
+# ---- Data Preparation ----
+def save_checkpoint(state, path):
+    # Write to a temp file and rename: a crash mid-write leaves the previous checkpoint intact
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".pt")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            torch.save(state, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def to_tensors(X, y, scaler):
+    # One contiguous float32 buffer per split, shaped (batch, seq_len=1, features);
+    # torch.from_numpy shares the buffer instead of copying it again
+    X_scaled = np.ascontiguousarray(scaler.transform(X), dtype=np.float32)[:, None, :]
+    y_array = np.ascontiguousarray(y, dtype=np.float32)
+    X_tensor, y_tensor = torch.from_numpy(X_scaled), torch.from_numpy(y_array)
+    if torch.cuda.is_available():
+        X_tensor, y_tensor = X_tensor.pin_memory(), y_tensor.pin_memory()
+    return X_tensor, y_tensor
+
+
+def make_loader(X_tensor, y_tensor, batch_size, shuffle, num_workers, seed):
+    # Batch-level sampling: each worker fetch slices a whole batch out of the
+    # preallocated tensors instead of collating batch_size single rows
+    dataset = TensorDataset(X_tensor, y_tensor)
+    generator = torch.Generator().manual_seed(seed)
+    base_sampler = RandomSampler(dataset, generator=generator) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(base_sampler, batch_size=batch_size, drop_last=False),
+        batch_size=None,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+        pin_memory=torch.cuda.is_available(),
+    )
+
+
+def evaluate(model, loader, criterion, device):
+    model.eval()
+    total_loss, preds, targets = 0.0, [], []
+    with torch.no_grad():
+        for xb, yb in loader:
+            xb, yb = xb.to(device, non_blocking=True), yb.to(device, non_blocking=True)
+            outputs = model(xb).squeeze(1)
+            total_loss += criterion(outputs, yb).item() * len(yb)
+            preds.append(outputs.cpu().numpy())
+            targets.append(yb.cpu().numpy())
+    preds, targets = np.concatenate(preds), np.concatenate(targets)
+    auc = roc_auc_score(targets, preds) if len(np.unique(targets)) > 1 else float("nan")
+    return total_loss / len(targets), auc
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the LSTM margin call model")
+    parser.add_argument("--epochs", type=int, default=200, help="Maximum number of epochs")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--patience", type=int, default=10, help="Epochs without validation improvement before stopping")
+    parser.add_argument("--lr-patience", type=int, default=3, help="Epochs without improvement before halving the learning rate")
+    parser.add_argument("--val-fraction", type=float, default=HOLDOUT_FRACTION, help="Share of the most recent dates held out")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="DataLoader worker processes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--resume", action="store_true", help="Continue from --checkpoint if it exists")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(args.seed)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # 1. Load data (chronological, only the columns training needs), ingesting new CSVs first
+    ensure_store()
+    df = load_features(columns=["Date", "Client"] + NUMERIC_FEATURES + [TARGET])
+
+    # 2. Encode Client with the shared encoder
+    client_encoder = load_client_encoder()
+    X, y = feature_matrix(df, client_encoder)
+    X, y = X[FEATURES].to_numpy(dtype=np.float32), y.to_numpy()
+
+    # 3. Time-based split
+    train_mask, cutoff = time_based_split(df, args.val_fraction)
+    X_train, y_train = X[train_mask], y[train_mask]
+    X_val, y_val = X[~train_mask], y[~train_mask]
+    print(f"Train: {len(X_train)} rows before {str(cutoff)[:10]}, Validation: {len(X_val)} rows from {str(cutoff)[:10]}")
+
+    # 4. Model, Loss, Optimizer and LR schedule
+    model = LSTMModel(input_size=len(FEATURES)).to(device)
+    criterion = nn.BCELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="min", factor=0.5, patience=args.lr_patience)
+
+    start_epoch = 0
+    best_val_loss = float("inf")
+    best_state = None
+    epochs_without_improvement = 0
+    scaler = None
+
+    # 5. Resume from checkpoint (keeps the scaler that was fitted when the run started)
+    if args.resume and os.path.exists(args.checkpoint):
+        checkpoint = torch.load(args.checkpoint, weights_only=False)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        scheduler.load_state_dict(checkpoint["scheduler"])
+        scaler = checkpoint["scaler"]
+        start_epoch = checkpoint["epoch"] + 1
+        best_val_loss = checkpoint["best_val_loss"]
+        best_state = checkpoint["best_state"]
+        epochs_without_improvement = checkpoint["epochs_without_improvement"]
+        torch.set_rng_state(checkpoint["rng_state"])
+        print(f"Resumed from {args.checkpoint} at epoch {start_epoch + 1}")
+
+    # 6. Normalize features: scaler is fitted on the training split only
+    if scaler is None:
+        scaler = MinMaxScaler()
+        scaler.fit(X_train)
+
+    X_train_tensor, y_train_tensor = to_tensors(X_train, y_train, scaler)
+    X_val_tensor, y_val_tensor = to_tensors(X_val, y_val, scaler)
+    train_loader = make_loader(X_train_tensor, y_train_tensor, args.batch_size, True, args.workers, args.seed + start_epoch)
+    val_loader = make_loader(X_val_tensor, y_val_tensor, max(args.batch_size, 1024), False, 0, args.seed)
+
+    # 7. Train the Model
+    print("Training LSTM Model...")
+    for epoch in range(start_epoch, args.epochs):
+        model.train()
+        started = time.perf_counter()
+        train_loss, seen = 0.0, 0
+        for xb, yb in train_loader:
+            xb, yb = xb.to(device, non_blocking=True), yb.to(device, non_blocking=True)
+            optimizer.zero_grad()
+            outputs = model(xb).squeeze(1)
+            loss = criterion(outputs, yb)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item() * len(yb)
+            seen += len(yb)
+        elapsed = time.perf_counter() - started
+
+        val_loss, val_auc = evaluate(model, val_loader, criterion, device)
+        scheduler.step(val_loss)
+
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            best_state = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
+            epochs_without_improvement = 0
+        else:
+            epochs_without_improvement += 1
+
+        print(
+            f"Epoch {epoch+1}/{args.epochs}, Loss: {train_loss / seen:.4f}, Val Loss: {val_loss:.4f}, "
+            f"Val AUC: {val_auc:.4f}, LR: {optimizer.param_groups[0]['lr']:.2e}, "
+            f"Throughput: {seen / elapsed:,.0f} samples/sec"
+        )
+
+        save_checkpoint({
+            "epoch": epoch,
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "scaler": scaler,
+            "best_val_loss": best_val_loss,
+            "best_state": best_state,
+            "epochs_without_improvement": epochs_without_improvement,
+            "rng_state": torch.get_rng_state(),
+        }, args.checkpoint)
+
+        if epochs_without_improvement >= args.patience:
+            print(f"Early stopping: no validation improvement for {args.patience} epochs")
+            break
+
+    if best_state is None:
+        raise SystemExit(
+            f"❌ No epoch was trained (--epochs {args.epochs}, starting at epoch {start_epoch + 1}), nothing to publish"
+        )
+
+    # 8. Publish the best Model, its Scaler and the encoder it was trained with as a new registry version
+    with tempfile.TemporaryDirectory() as staging_dir:
+        model_path = os.path.join(staging_dir, MODEL_PATH)
+        scaler_path = os.path.join(staging_dir, SCALER_PATH)
+        torch.save(best_state, model_path)
+        joblib.dump(scaler, scaler_path)
+        publish_version(
+            {"lstm": model_path, "scaler": scaler_path, "client_encoder": CLIENT_ENCODER_PATH},
+            metadata={
+                "trainer": "lstm",
+                "validation_cutoff": str(cutoff)[:10],
+                "best_val_loss": round(float(best_val_loss), 4),
+            },
+        )
+
+    print(f"✅ LSTM model (best Val Loss: {best_val_loss:.4f}) and scaler saved!")
+
+
+if __name__ == "__main__":
+    main()